@@ -1,5 +1,8 @@
+import inspect
 from functools import wraps
 
+from .tracing import span
+
 
 class Check(object):
     """
@@ -38,14 +41,27 @@ class Check(object):
         Throws FailedCheck if the check fails.
         """
         def decorator(func):
-            @wraps(func)
-            async def wrapper(ctx, *fargs, **fkargs):
-                result = await self.run(ctx, *args, **kwargs)
-                if not result:
-                    raise FailedCheck(self)
+            if inspect.isasyncgenfunction(func):
+                # Streaming commands, run the check before the first chunk
+                @wraps(func)
+                async def wrapper(ctx, *fargs, **fkargs):
+                    result = await self.run(ctx, *args, **kwargs)
+                    if not result:
+                        raise FailedCheck(self)
+
+                    async for chunk in func(ctx, *fargs, **fkargs):
+                        yield chunk
+            else:
+                @wraps(func)
+                async def wrapper(ctx, *fargs, **fkargs):
+                    result = await self.run(ctx, *args, **kwargs)
+                    if not result:
+                        raise FailedCheck(self)
 
-                return await func(ctx, *fargs, **fkargs)
+                    return await func(ctx, *fargs, **fkargs)
 
+            # Record the applied checks, so they may be evaluated without running the function
+            wrapper.checks = [(self, args, kwargs)] + getattr(func, 'checks', [])
             return wrapper
         return decorator
 
@@ -53,18 +69,19 @@ class Check(object):
         """
         Executes this check and returns `True` if it passes or `False` if it fails.
         """
-        # First check the parents
-        for check in self.parents:
-            if await check.run(ctx, *args, **kwargs):
-                return True
-
-        # Then check the requirements
-        for check in self.required:
-            if not await check.run(ctx, *args, **kwargs):
-                return False
-
-        # Now if we have passed all these, check the main function
-        return await self.check_func(ctx, *args, **kwargs)
+        with span(ctx.trace, "check", check=self.name):
+            # First check the parents
+            for check in self.parents:
+                if await check.run(ctx, *args, **kwargs):
+                    return True
+
+            # Then check the requirements
+            for check in self.required:
+                if not await check.run(ctx, *args, **kwargs):
+                    return False
+
+            # Now if we have passed all these, check the main function
+            return await self.check_func(ctx, *args, **kwargs)
 
 
 class FailedCheck(Exception):
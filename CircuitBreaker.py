@@ -0,0 +1,137 @@
+import time
+import logging
+from collections import deque
+
+from .logger import log
+from .lib import CircuitOpen
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker for a command or module, tripped by the failure rate of recent invocations.
+    Unexpected exceptions and timeouts count as failures, while check failures,
+    safe cancellations and edit cancellations are ignored.
+
+    While closed, invocations run normally.
+    Once at least `min_calls` invocations in the last `window` seconds have a failure rate
+    of at least `threshold`, the breaker opens, and invocations fail fast with `CircuitOpen`.
+    After `reset_timeout` seconds the breaker is half-open, and admits up to `probes` concurrent invocations.
+    A successful probe closes the breaker, and a failed probe opens it again.
+
+    Parameters
+    ----------
+    threshold: float
+        Failure rate at which the breaker opens.
+    min_calls: int
+        Minimum number of invocations in the window before the breaker may open.
+    window: float
+        Number of seconds of invocation outcomes to consider.
+    reset_timeout: float
+        Number of seconds to stay open before probing.
+    probes: int
+        Maximum number of concurrent invocations while half-open.
+    msg: Optional[str]
+        Message to reply with while open, defaulting to the `CircuitOpen` message.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    # Invocation outcomes considered by the breaker, as returned by `Command.run`
+    successes = ("success",)
+    failures = ("error", "timeout")
+
+    def __init__(self, threshold=0.5, min_calls=10, window=30, reset_timeout=30, probes=1, msg=None, name=None):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.msg = msg
+        self.name = name
+
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.probing = 0
+        self.outcomes = deque()  # Recent outcomes, [(timestamp, failed)]
+        self.failed = 0  # Number of failures in `outcomes`
+        self.trips = 0
+
+    def _set_state(self, state):
+        if state != self.state:
+            log("Circuit breaker is now {}.".format(state.replace('_', '-')),
+                context=self.name or "BREAKER",
+                level=logging.WARNING if state == self.OPEN else logging.INFO)
+            self.state = state
+
+    def _prune(self, now):
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            _, failed = self.outcomes.popleft()
+            self.failed -= failed
+
+    def acquire(self):
+        """
+        Admit an invocation, or raise `CircuitOpen` if the breaker is rejecting invocations.
+        Every admitted invocation must be followed by a call to `record`.
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpen(self.msg, details="Circuit breaker '{}' is open.".format(self.name))
+            self._set_state(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            if self.probing >= self.probes:
+                raise CircuitOpen(self.msg, details="Circuit breaker '{}' is half-open.".format(self.name))
+            self.probing += 1
+
+    def record(self, outcome):
+        """
+        Record the outcome of an admitted invocation.
+        """
+        failed = outcome in self.failures
+        if self.state == self.HALF_OPEN:
+            self.probing = max(self.probing - 1, 0)
+            if failed:
+                self.trip()
+            elif outcome in self.successes:
+                self.outcomes.clear()
+                self.failed = 0
+                self._set_state(self.CLOSED)
+            return
+
+        if not failed and outcome not in self.successes:
+            return
+
+        now = time.monotonic()
+        self.outcomes.append((now, failed))
+        self.failed += failed
+        self._prune(now)
+        if (self.state == self.CLOSED and len(self.outcomes) >= self.min_calls
+                and self.failed / len(self.outcomes) >= self.threshold):
+            self.trip()
+
+    def trip(self):
+        """
+        Open the breaker.
+        """
+        self.trips += 1
+        self.opened_at = time.monotonic()
+        self.probing = 0
+        self._set_state(self.OPEN)
+
+    def reset(self):
+        """
+        Close the breaker and forget the recent outcomes.
+        """
+        self.outcomes.clear()
+        self.failed = 0
+        self.probing = 0
+        self._set_state(self.CLOSED)
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'calls': len(self.outcomes),
+            'failures': self.failed,
+            'trips': self.trips
+        }
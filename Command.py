@@ -1,11 +1,17 @@
+import time
 import logging
+import inspect
 import traceback
 import asyncio
 import textwrap
+import importlib
+import importlib.util
 
 from .logger import log
 from .Check import FailedCheck
-from .lib import SafeCancellation, flag_parser
+from .lib import SafeCancellation, flag_parser, sterilise_content
+from .tracing import span
+from .converters import command_params, convert_arguments
 
 
 class Command(object):
@@ -16,24 +22,82 @@ class Command(object):
 
         self.handle_edits = kwargs.pop("handle_edits", True)
 
+        # Executor to offload the command function to, one of `None`, "thread" or "process"
+        self.executor = kwargs.pop("executor", None)
+        if self.executor not in (None, "thread", "process"):
+            raise ValueError("Unknown command executor '{}'.".format(self.executor))
+        if self.executor is not None and (inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func)):
+            # This includes functions wrapped by checks, which may not run on a flattened context
+            raise ValueError("Offloaded commands must be plain synchronous functions without checks.")
+        if self.executor == "process" and (not _importable(func.__module__) or '<locals>' in func.__qualname__):
+            # The worker imports the function by name, see `_offloaded_call`
+            raise ValueError("Commands offloaded to a process pool must be defined at the top level of an importable "
+                             "module, which excludes modules loaded with `load_dir`.")
+
+        # Async generator functions stream their yielded chunks to the channel
+        self.streaming = inspect.isasyncgenfunction(func)
+        if self.streaming and self.executor is not None:
+            raise ValueError("Streaming commands may not be offloaded to an executor.")
+
+        # Parameters filled from the arguments by their annotated converters
+        self.params = command_params(func) if self.executor is None else []
+
+        # Whether to send partially filled messages early and edit them as chunks arrive
+        self.paginate = kwargs.pop("paginate", False)
+        self.page_limit = kwargs.pop("page_limit", 2000)
+        self.edit_interval = kwargs.pop("edit_interval", 1)
+
+        # Optional `ResultCache` for idempotent commands
+        self.cache = kwargs.pop("cache", None)
+
+        # Time budget in seconds, overriding the module and client defaults
+        self.timeout = kwargs.pop("timeout", None)
+        self.timeouts = 0  # Number of invocations which timed out
+
+        # Optional `CircuitBreaker`, in addition to the module breaker
+        self.breaker = kwargs.pop("breaker", None)
+        if self.breaker is not None and self.breaker.name is None:
+            self.breaker.name = name
+
         self.aliases = kwargs.pop("aliases", [])
         self.flags = kwargs.pop("flags", [])
         self.hidden = kwargs.pop("hidden", False)
         self.short_help = kwargs.pop('short_help', None)
         self.long_help = self.parse_help()
 
+        # Stable ordinal assigned by the client name registry
+        self.ordinal = None
+
         self.__dict__.update(kwargs)
 
     async def run(self, ctx):
         """
         Safely execute this command with the current context.
         Respond and log any exceptions that arise.
+        Returns the outcome of the invocation, one of
+        "success", "failed_check", "cancelled_safely", "timeout", "cancelled" or "error".
         """
+        timer = None
+        outcome = None
+        breakers = []
         try:
+            for breaker in (self.module.breaker, self.breaker):
+                if breaker is not None:
+                    breaker.acquire()
+                    breakers.append(breaker)
+
             task = asyncio.ensure_future(self.exec_wrapper(ctx))
             ctx.tasks.append(task)
+
+            timeout = self.get_timeout(ctx)
+            if timeout is not None:
+                loop = asyncio.get_event_loop()
+                ctx.deadline = loop.time() + timeout
+                timer = loop.call_at(ctx.deadline, self._expire, ctx, task)
+
             await task
         except FailedCheck as e:
+            outcome = "failed_check"
             log("Command failed check: {}".format(e.check.name),
                 context="mid:{}".format(ctx.msg.id),
                 level=logging.DEBUG)
@@ -41,6 +105,7 @@ class Command(object):
             if e.check.msg:
                 await ctx.error_reply(e.check.msg)
         except SafeCancellation as e:
+            outcome = "cancelled_safely"
             log("Caught a safe command cancellation: {}: {}".format(e.__class__.__name__, e.details),
                 context="mid:{}".format(ctx.msg.id),
                 level=logging.DEBUG)
@@ -48,29 +113,77 @@ class Command(object):
             if e.msg is not None:
                 await ctx.error_reply(e.msg)
         except asyncio.TimeoutError:
+            outcome = "timeout"
+            self.timeouts += 1
             log("Caught an unhandled TimeoutError", context="mid:{}".format(ctx.msg.id), level=logging.WARNING)
 
             await ctx.error_reply("Operation timed out.")
         except asyncio.CancelledError:
-            log("Command was cancelled, probably due to a message edit.",
-                context="mid:{}".format(ctx.msg.id),
-                level=logging.DEBUG)
+            if ctx.timed_out:
+                outcome = "timeout"
+                self.timeouts += 1
+                log("Command exceeded its time budget and was cancelled.",
+                    context="mid:{}".format(ctx.msg.id),
+                    level=logging.WARNING)
+
+                await ctx.error_reply("Operation timed out.")
+            else:
+                outcome = "cancelled"
+                log("Command was cancelled, probably due to a message edit.",
+                    context="mid:{}".format(ctx.msg.id),
+                    level=logging.DEBUG)
         except Exception as e:
-            full_traceback = traceback.format_exc()
-            only_error = "".join(traceback.TracebackException.from_exception(e).format_exception_only())
+            outcome = "error"
+            only_error = "".join(traceback.format_exception_only(type(e), e))
 
-            log("Caught the following exception while running command:\n{}".format(full_traceback),
-                context="mid:{}".format(ctx.msg.id),
-                level=logging.ERROR)
+            # Only log the full traceback for the first occurrence of each error
+            record = ctx.client.errors.record(e, self.name)
+            if record.count == 1:
+                log("Caught the following exception while running command:\n{}".format(traceback.format_exc()),
+                    context="mid:{}".format(ctx.msg.id),
+                    level=logging.ERROR)
+            elif ctx.client.errors.is_sampled(record):
+                log("Caught a repeated exception while running command ({} occurrences):\n{}".format(
+                        record.count, only_error.strip()),
+                    context="mid:{}".format(ctx.msg.id),
+                    level=logging.ERROR)
 
             await ctx.reply(
                 ("An unexpected internal error occurred while running your command! "
                  "Please report the following error to the developer:\n`{}`").format(only_error)
             )
         else:
+            outcome = "success"
             log("Command completed execution without error.",
                 context="mid:{}".format(ctx.msg.id),
                 level=logging.DEBUG)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            for breaker in breakers:
+                breaker.record(outcome)
+        return outcome
+
+    @staticmethod
+    def _expire(ctx, task):
+        """
+        Deadline callback, cancelling the command task.
+        Flags the context first, since callbacks may run slightly before the deadline.
+        """
+        if not task.done():
+            ctx.timed_out = True
+            task.cancel()
+
+    def get_timeout(self, ctx):
+        """
+        Returns the time budget for this command in seconds, or `None` if it is unbounded.
+        The command timeout takes precedence over the module timeout, which takes precedence over the client default.
+        """
+        if self.timeout is not None:
+            return self.timeout
+        if self.module.timeout is not None:
+            return self.module.timeout
+        return ctx.client.command_timeout
 
     async def exec_wrapper(self, ctx):
         """
@@ -78,16 +191,122 @@ class Command(object):
         May raise an exception if not handled by the module on_exception handler.
         """
         try:
-            await self.module.pre_command(ctx)
-            if self.flags:
-                flags, ctx.args = flag_parser(ctx.arg_str, self.flags)
-                await self.func(ctx, flags=flags)
-            else:
-                await self.func(ctx)
-            await self.module.post_command(ctx)
+            with span(ctx.trace, "pre_command"):
+                await self.module.pre_command(ctx)
+            with span(ctx.trace, "command", cmd=self.name):
+                if self.cache is not None:
+                    await self.cache.run(ctx, self.exec_func)
+                else:
+                    await self.exec_func(ctx)
+            with span(ctx.trace, "post_command"):
+                await self.module.post_command(ctx)
         except Exception as e:
             await self.module.on_exception(ctx, e)
 
+    async def exec_func(self, ctx):
+        """
+        Parse the flags and execute the command function.
+        """
+        if self.executor is not None:
+            await self.exec_offloaded(ctx)
+            return
+
+        kwargs = {}
+        if self.flags:
+            kwargs['flags'], ctx.args = flag_parser(ctx.arg_str, self.flags)
+        if self.params:
+            kwargs.update(await convert_arguments(ctx, self.params, ctx.args or ""))
+
+        if self.streaming:
+            await self.exec_stream(ctx, self.func(ctx, **kwargs))
+        else:
+            await self.func(ctx, **kwargs)
+
+    async def exec_stream(self, ctx, stream):
+        """
+        Stream the chunks yielded by a streaming command to the channel.
+        Chunks are sterilised, joined with newlines and packed into messages of at most `page_limit` characters,
+        and each message is sent as soon as it is full, so only one message is held in memory.
+        If `paginate` is set, the current message is also sent before it is full,
+        and edited with the new chunks at most once every `edit_interval` seconds until it is full.
+        """
+        page = []
+        length = 0
+        message = None
+        last_edit = 0
+        last_content = None
+
+        async def show(final):
+            nonlocal message, page, length, last_edit, last_content
+            content = "\n".join(page)
+            if message is None:
+                # The message is edited as chunks arrive, so it may not be shared with other replies
+                message = await ctx.reply(content, allow_everyone=True, merge=False)
+            elif content != last_content:
+                # Edited messages may not be replayed from the result cache
+                ctx.reply_log = None
+                await message.edit(content=content)
+            last_edit = time.monotonic()
+            last_content = content
+            if final:
+                # Full pages are kept, and the next page is sent as a new message
+                page = []
+                length = 0
+                message = None
+                last_content = None
+
+        limit = self.page_limit
+        try:
+            async for chunk in stream:
+                # Sterilise before packing, since sterilising may lengthen the chunk.
+                # Pings may not span chunks, as they are separated by newlines.
+                chunk = sterilise_content(str(chunk))
+                for i in range(0, len(chunk), limit):
+                    piece = chunk[i:i + limit]
+                    if page and length + len(piece) + 1 > limit:
+                        await show(final=True)
+                    page.append(piece)
+                    length += len(piece) + (1 if length else 0)
+                if self.paginate and page and time.monotonic() - last_edit >= self.edit_interval:
+                    await show(final=False)
+        finally:
+            await stream.aclose()
+
+        if page:
+            await show(final=True)
+
+    async def exec_offloaded(self, ctx):
+        """
+        Execute the command function in the client executor pool given by `executor`.
+        The function is synchronous, and is called with a flattened snapshot of the context and the parsed args,
+        along with the parsed flags if the command has any.
+        Cancelling the awaiting task (e.g. on message edit) abandons the result.
+        """
+        kwargs = {}
+        if self.flags:
+            kwargs['flags'], ctx.args = flag_parser(ctx.arg_str, self.flags)
+
+        if self.executor == "process":
+            # The decorated function name is bound to the `Command`, so pass a reference to import in the worker
+            result = await ctx.client.run_in_executor(
+                self.executor, _offloaded_call, self.func.__module__, self.func.__qualname__,
+                ctx.flatten(), ctx.args, **kwargs
+            )
+        else:
+            result = await ctx.client.run_in_executor(
+                self.executor, self.func, ctx.flatten(), ctx.args, **kwargs
+            )
+        await self.handle_result(ctx, result)
+
+    async def handle_result(self, ctx, result):
+        """
+        Result hook for offloaded commands.
+        Replies with the result if it is not `None`.
+        Intended to be overridden.
+        """
+        if result is not None:
+            await ctx.reply(result)
+
     def parse_help(self):
         """
         Convert the docstring of the command function into a list of (fieldname, fieldcontent) tuples.
@@ -123,3 +342,33 @@ class Command(object):
             help_fields.append((field_name, field))
 
         return help_fields
+
+
+def _importable(name):
+    """
+    Whether the module with the given name may be imported by name in a fresh process.
+    Modules loaded from a file path, such as those loaded by `load_dir`, are only found in `sys.modules`.
+    """
+    if name == '__main__':
+        # Process pools make the main module of the parent available to the workers
+        return True
+    parts = name.split('.')
+    try:
+        # Checking each parent rejects the `load_dir` names, such as `bot_module_cmds.py`, which have no parent package
+        return all(importlib.util.find_spec('.'.join(parts[:i])) is not None for i in range(1, len(parts) + 1))
+    except (ImportError, ValueError):
+        return False
+
+
+def _offloaded_call(module, qualname, flatctx, args, **kwargs):
+    """
+    Entry point for commands offloaded to a process pool.
+    Imports the module defining the command function in the worker, so does not depend on the process start method.
+    The module must therefore be importable by name, which excludes modules loaded with `load_dir`.
+    """
+    obj = importlib.import_module(module)
+    for attr in qualname.split('.'):
+        obj = getattr(obj, attr)
+    if isinstance(obj, Command):
+        obj = obj.func
+    return obj(flatctx, args, **kwargs)
@@ -2,9 +2,10 @@ from collections import namedtuple
 
 import datetime
 import discord
-import asyncio  # noqa
+import asyncio
 # from .logger import log
 from . import lib
+from .tracing import span
 
 from . import cmdClient  # noqa
 from .Command import Command  # noqa
@@ -42,7 +43,11 @@ class Context(object):
         'sent_messages',
         'cleanup_on_edit',
         'reparse_on_edit',
-        'tasks'
+        'tasks',
+        'reply_log',
+        'deadline',
+        'timed_out',
+        'trace'
     )
 
     def __init__(self, client, **kwargs):
@@ -58,6 +63,7 @@ class Context(object):
         self.cmd = kwargs.pop("cmd", None)  # type: Command
         self.alias = kwargs.pop("alias", None)  # type: str
         self.prefix = kwargs.pop("prefix", None)  # type: str
+        self.trace = kwargs.pop("trace", None)  # type: Optional[tracing.Trace]
 
         self.cleanup_on_edit = kwargs.pop(
             "cleanup_on_edit",
@@ -78,6 +84,13 @@ class Context(object):
         # Context tasks, including for the final wrapped command
         self.tasks = []  # type: List[asyncio.Task]
 
+        # Event loop time at which the command is cancelled, `None` if unbounded
+        self.deadline = None  # type: Optional[float]
+        self.timed_out = False  # Whether the command was cancelled by its deadline
+
+        # Log of replies for result caching, `None` when not recording
+        self.reply_log = None  # type: Optional[List[Tuple[str, dict]]]
+
     @classmethod
     def util(cls, util_func):
         """
@@ -107,16 +120,43 @@ class Context(object):
 
 
 @Context.util
-async def reply(ctx, content=None, allow_everyone=False, **kwargs):
+def time_left(ctx, timeout=None):
+    """
+    Returns the number of seconds until the context deadline, capped at `timeout`.
+    Returns `timeout` if the context has no deadline.
+    """
+    if ctx.deadline is None:
+        return timeout
+    remaining = max(ctx.deadline - asyncio.get_event_loop().time(), 0)
+    return remaining if timeout is None else min(remaining, timeout)
+
+
+@Context.util
+async def reply(ctx, content=None, allow_everyone=False, wait=True, merge=True, **kwargs):
     """
     Helper function to reply in the current channel.
+    When the client has a send queue and `wait` is `False`, returns `None` without waiting for the send,
+    allowing consecutive replies to be merged.
+    Replies which will be edited should unset `merge`, so they are not merged with other replies.
     """
     if not allow_everyone:
         if content:
             content = lib.sterilise_content(content)
 
-    message = await ctx.ch.send(content=content, **kwargs)
-    ctx.sent_messages.append(message)
+    if ctx.reply_log is not None:
+        if 'file' in kwargs or 'files' in kwargs:
+            # Files may not be resent, so the result is uncacheable
+            ctx.reply_log = None
+        else:
+            ctx.reply_log.append((content, kwargs))
+
+    with span(ctx.trace, "reply"):
+        if ctx.client.send_queue is not None:
+            # The send queue records the message in `sent_messages` once sent
+            message = await ctx.client.send_queue.send(ctx, content, wait=wait, merge=merge, **kwargs)
+        else:
+            message = await ctx.ch.send(content=content, **kwargs)
+            ctx.sent_messages.append(message)
     return message
 
 
@@ -132,10 +172,34 @@ async def error_reply(ctx, error_str):
         timestamp=datetime.datetime.utcnow()
     )
     try:
-        message = await ctx.ch.send(embed=embed)
-        ctx.sent_messages.append(message)
-        return message
+        return await ctx.reply(embed=embed)
     except discord.Forbidden:
-        message = await ctx.reply(error_str)
-        ctx.sent_messages.append(message)
-        return message
+        return await ctx.reply(error_str)
+
+
+@Context.util
+async def input(ctx, prompt=None, timeout=120):
+    """
+    Prompt the author for input in the current channel, and wait for their next message.
+    Raises `ResponseTimedOut` if no response is received within `timeout` seconds,
+    and `UserCancelled` if the author responds with `c` or `cancel`.
+    Returns the content of the response.
+    """
+    if prompt:
+        await ctx.reply(prompt)
+
+    # Interactive sessions may not be replayed from the result cache
+    ctx.reply_log = None
+
+    future = ctx.client.add_input_waiter(ctx.ch.id, ctx.author.id)
+    try:
+        message = await asyncio.wait_for(future, ctx.time_left(timeout))
+    except asyncio.TimeoutError:
+        raise lib.ResponseTimedOut("Session timed out waiting for user response!")
+    finally:
+        ctx.client.remove_input_waiter(ctx.ch.id, ctx.author.id, future)
+
+    if message.content.strip().lower() in ('c', 'cancel'):
+        raise lib.UserCancelled("User cancelled the session!")
+
+    return message.content
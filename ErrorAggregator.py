@@ -0,0 +1,140 @@
+import time
+import asyncio
+import logging
+from cachetools import LRUCache
+
+from .logger import log
+
+
+class ErrorRecord(object):
+    """
+    Aggregated occurrences of a single error fingerprint.
+    """
+    __slots__ = ('fingerprint', 'count', 'reported', 'first_seen', 'last_seen', 'last_error', 'commands')
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.reported = 1  # Count at the last summary, the first occurrence is logged in full
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+        self.last_error = None
+        self.commands = {}  # Occurrences per command, {cmdname: int}
+
+    def as_dict(self):
+        exc_type, filename, lineno, funcname = self.fingerprint
+        return {
+            'type': exc_type,
+            'location': "{}:{} in {}".format(filename, lineno, funcname),
+            'count': self.count,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'last_error': self.last_error,
+            'commands': dict(self.commands)
+        }
+
+
+class ErrorAggregator(object):
+    """
+    Aggregates unexpected command exceptions by fingerprint, to suppress log storms.
+    An exception fingerprint is its type along with the frame where it was raised.
+    The first occurrence of a fingerprint should be logged in full, and repeats are only counted,
+    with every `sample_rate`th repeat logged briefly and a summary logged every `summary_interval` seconds.
+
+    Parameters
+    ----------
+    sample_rate: int
+        Log one in every `sample_rate` repeated occurrences.
+    summary_interval: float
+        Number of seconds between summaries of repeated errors.
+    maxsize: int
+        Maximum number of fingerprints to track.
+    """
+    def __init__(self, sample_rate=100, summary_interval=60, maxsize=1000):
+        self.sample_rate = sample_rate
+        self.summary_interval = summary_interval
+
+        self.records = LRUCache(maxsize)  # {fingerprint: ErrorRecord}
+        self.last_summary = time.monotonic()
+        self.summary_task = None  # Periodic summary task, started on the first record
+
+    @staticmethod
+    def fingerprint(exception):
+        """
+        Returns the fingerprint of an exception, without formatting the traceback.
+        """
+        tb = exception.__traceback__
+        if tb is None:
+            location = (None, None, None)
+        else:
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            code = tb.tb_frame.f_code
+            location = (code.co_filename, tb.tb_lineno, code.co_name)
+        exc_type = type(exception)
+        return ("{}.{}".format(exc_type.__module__, exc_type.__qualname__),) + location
+
+    def record(self, exception, cmdname=None):
+        """
+        Record an occurrence of the given exception.
+        Returns the `ErrorRecord` of the exception fingerprint.
+        """
+        if self.summary_task is None:
+            self.summary_task = asyncio.ensure_future(self._summary_loop())
+
+        fingerprint = self.fingerprint(exception)
+        record = self.records.get(fingerprint, None)
+        if record is None:
+            record = self.records[fingerprint] = ErrorRecord(fingerprint)
+        record.count += 1
+        record.last_seen = time.time()
+        record.last_error = "{}: {}".format(fingerprint[0], exception)
+        if cmdname is not None:
+            record.commands[cmdname] = record.commands.get(cmdname, 0) + 1
+        return record
+
+    def is_sampled(self, record):
+        """
+        Whether a repeated occurrence should be logged.
+        """
+        return record.count > 1 and record.count % self.sample_rate == 0
+
+    def log_summary(self):
+        """
+        Log the number of repeated occurrences of each error since the last summary.
+        """
+        self.last_summary = time.monotonic()
+        lines = []
+        for record in self.records.values():
+            if record.count > record.reported:
+                lines.append("{} repeated occurrences ({} total) of {} at {}:{} in {}.".format(
+                    record.count - record.reported, record.count, *record.fingerprint
+                ))
+                record.reported = record.count
+        if lines:
+            log("Summary of command exceptions since the last summary:\n{}".format('\n'.join(lines)),
+                context="ERRORS",
+                level=logging.WARNING)
+
+    async def _summary_loop(self):
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            self.log_summary()
+
+    async def on_drain(self, client):
+        """
+        Drain hook stopping the summary task and logging the final summary.
+        """
+        if self.summary_task is not None:
+            self.summary_task.cancel()
+            self.summary_task = None
+        self.log_summary()
+
+    def summary(self):
+        """
+        Returns a list of the tracked errors as dictionaries, most frequent first.
+        """
+        return sorted((record.as_dict() for record in self.records.values()), key=lambda d: -d['count'])
+
+    def clear(self):
+        self.records.clear()
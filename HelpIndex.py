@@ -0,0 +1,166 @@
+import copy
+import difflib
+from bisect import bisect_left
+from cachetools import LRUCache
+
+import discord
+
+
+class HelpIndex(object):
+    """
+    Precomputed help data for the client commands.
+    Maintains pre-rendered help embeds for each command and each module,
+    along with sorted and fuzzy lookup of command names.
+    The index is rebuilt when the command registry or the command overrides change,
+    and filtered lookups are memoised per filter.
+
+    Parameters
+    ----------
+    client: cmdClient
+        The client to index the commands of.
+    page_limit: int
+        Maximum length of the description of a module page.
+    """
+    def __init__(self, client, page_limit=2048):
+        self.client = client
+        self.page_limit = page_limit
+
+        self._version = None
+        self._names = []  # Sorted lowercase command names and aliases
+        self._commands = {}  # Commands by lowercase name and alias, {name: Command}
+        self._embeds = {}  # Rendered command help embeds, {cmdname: dict}
+        self._lines = []  # Module listing lines, [(modulename, Command, line)]
+        self._memo = LRUCache(1024)  # Filtered lookups, {(kind, *args): result}
+
+    def invalidate(self):
+        """
+        Force the index to be rebuilt on the next lookup.
+        """
+        self._version = None
+
+    def _ensure(self):
+        version = (self.client.cmd_version, self.client.overrides.version)
+        if version != self._version:
+            self._build()
+            self._version = version
+
+    def _build(self):
+        cmds = self.client.cmds
+        self._commands = {name.lower(): cmd for name, cmd in self.client.cmd_names.items()}
+        self._names = sorted(self._commands)
+        self._embeds = {cmd.name: self.render_command(cmd).to_dict() for cmd in cmds}
+        self._lines = [
+            (cmd.module.name, cmd, "`{}`: {}".format(cmd.name, cmd.short_help or "No description."))
+            for cmd in sorted(cmds, key=lambda cmd: (cmd.module.name, cmd.name))
+        ]
+        self._memo.clear()
+
+    def render_command(self, cmd):
+        """
+        Render the help embed for a single command from its `long_help`.
+        Intended to be overridden for custom help formatting.
+        """
+        embed = discord.Embed(title="`{}` command".format(cmd.name), description=cmd.short_help or None)
+        for name, content in cmd.long_help:
+            embed.add_field(name=name or "Description", value=content[:1024] or "-", inline=False)
+        if cmd.aliases:
+            embed.add_field(name="Aliases", value=", ".join("`{}`".format(alias) for alias in cmd.aliases))
+        return embed
+
+    def _visible(self, cmd, show_hidden, guildid):
+        if cmd.hidden and not show_hidden:
+            return False
+        return guildid is None or self.client.overrides.is_enabled(cmd, guildid)
+
+    def _filter_key(self, show_hidden, guildid):
+        # Guilds with identical overrides share memoised results
+        return (show_hidden, guildid is not None, self.client.overrides.signature(guildid))
+
+    def get(self, name):
+        """
+        Returns the command with the given name or alias, ignoring case, or `None` if it does not exist.
+        """
+        self._ensure()
+        return self._commands.get(name.lower(), None)
+
+    def command_embed(self, name):
+        """
+        Returns a copy of the help embed of the given command, or `None` if the command does not exist.
+        """
+        self._ensure()
+        cmd = self.get(name)
+        if cmd is None or cmd.name not in self._embeds:
+            return None
+        return discord.Embed.from_dict(copy.deepcopy(self._embeds[cmd.name]))
+
+    def pages(self, show_hidden=False, guildid=None):
+        """
+        Returns the module help pages visible under the given filter, as a list of embeds.
+
+        Parameters
+        ----------
+        show_hidden: bool
+            Whether to include hidden commands, e.g. for owners.
+        guildid: Optional[int]
+            Guild whose disabled commands should be excluded.
+        """
+        self._ensure()
+        key = ('pages',) + self._filter_key(show_hidden, guildid)
+        pages = self._memo.get(key, None)
+        if pages is None:
+            pages = self._memo[key] = self._render_pages(show_hidden, guildid)
+        return [discord.Embed.from_dict(copy.deepcopy(page)) for page in pages]
+
+    def _render_pages(self, show_hidden, guildid):
+        pages = []
+        current_module = None
+        lines = []
+        length = 0
+        for module, cmd, line in self._lines:
+            if not self._visible(cmd, show_hidden, guildid):
+                continue
+            if module != current_module or length + len(line) + 1 > self.page_limit:
+                if lines:
+                    pages.append(discord.Embed(title=current_module, description="\n".join(lines)).to_dict())
+                current_module = module
+                lines = []
+                length = 0
+            lines.append(line)
+            length += len(line) + 1
+        if lines:
+            pages.append(discord.Embed(title=current_module, description="\n".join(lines)).to_dict())
+        return pages
+
+    def prefix_search(self, prefix, limit=10, show_hidden=False, guildid=None):
+        """
+        Returns up to `limit` visible command names or aliases starting with `prefix`, in sorted order.
+        """
+        self._ensure()
+        prefix = prefix.lower()
+        key = ('prefix', prefix, limit) + self._filter_key(show_hidden, guildid)
+        result = self._memo.get(key, None)
+        if result is None:
+            result = []
+            i = bisect_left(self._names, prefix)
+            while i < len(self._names) and self._names[i].startswith(prefix) and len(result) < limit:
+                if self._visible(self._commands[self._names[i]], show_hidden, guildid):
+                    result.append(self._names[i])
+                i += 1
+            self._memo[key] = result
+        return list(result)
+
+    def fuzzy_search(self, query, limit=5, cutoff=0.6, show_hidden=False, guildid=None):
+        """
+        Returns up to `limit` visible command names or aliases similar to `query`, best matches first.
+        """
+        self._ensure()
+        query = query.lower()
+        key = ('fuzzy', query, limit, cutoff) + self._filter_key(show_hidden, guildid)
+        result = self._memo.get(key, None)
+        if result is None:
+            names = [
+                name for name in self._names
+                if self._visible(self._commands[name], show_hidden, guildid)
+            ]
+            result = self._memo[key] = difflib.get_close_matches(query, names, n=limit, cutoff=cutoff)
+        return list(result)
@@ -3,22 +3,35 @@ from typing import Type, Optional
 
 from . import cmdClient
 from .Command import Command
+from .CircuitBreaker import CircuitBreaker
 from .logger import log
 
 
 class Module:
     name: str = "Base Module"
 
-    def __init__(self, name: Optional[str] = None, baseCommand: Optional[Type[Command]] = Command):
+    def __init__(self, name: Optional[str] = None, baseCommand: Optional[Type[Command]] = Command,
+                 timeout: Optional[float] = None, breaker: Optional[CircuitBreaker] = None):
         if name:
             self.name = name
         self.baseCommand = baseCommand
 
+        # Default time budget in seconds for commands in this module
+        self.timeout = timeout
+
+        # Optional `CircuitBreaker` shared by all commands in this module
+        self.breaker = breaker
+        if breaker is not None and breaker.name is None:
+            breaker.name = self.name
+
         self.cmds = []
         self.initialised = False
         self.ready = False
         self.enabled = True
 
+        # Stable ordinal assigned by the client name registry
+        self.ordinal = None
+
         self.launch_tasks = []
         self.init_tasks = []
 
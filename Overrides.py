@@ -0,0 +1,197 @@
+import logging
+
+from .logger import log
+
+
+class _ScopeOverrides(object):
+    """
+    Command and module overrides for a single guild or channel.
+    Each mask is a bitset indexed by command or module ordinal.
+    """
+    __slots__ = ('cmd_on', 'cmd_off', 'module_on', 'module_off', 'channels')
+
+    def __init__(self):
+        self.cmd_on = 0
+        self.cmd_off = 0
+        self.module_on = 0
+        self.module_off = 0
+        self.channels = None  # Channel overrides within a guild, {channelid: _ScopeOverrides}
+
+    def set(self, bit, enabled, module=False):
+        on, off = ('module_on', 'module_off') if module else ('cmd_on', 'cmd_off')
+        setattr(self, on, getattr(self, on) & ~bit)
+        setattr(self, off, getattr(self, off) & ~bit)
+        if enabled is True:
+            setattr(self, on, getattr(self, on) | bit)
+        elif enabled is False:
+            setattr(self, off, getattr(self, off) | bit)
+
+    def state(self, cmd_bit, module_bit):
+        """
+        Returns `True` or `False` if the command is overridden in this scope, otherwise `None`.
+        Command overrides take precedence over module overrides.
+        """
+        if self.cmd_off & cmd_bit:
+            return False
+        if self.cmd_on & cmd_bit:
+            return True
+        if self.module_off & module_bit:
+            return False
+        if self.module_on & module_bit:
+            return True
+        return None
+
+    @property
+    def empty(self):
+        return not (self.cmd_on or self.cmd_off or self.module_on or self.module_off or self.channels)
+
+    @property
+    def signature(self):
+        return (self.cmd_on, self.cmd_off, self.module_on, self.module_off)
+
+
+class OverrideIndex(object):
+    """
+    Index of per-guild and per-channel command and module enable/disable overrides.
+    Overrides are stored as bitsets indexed by the stable command and module ordinals of the client.
+    Channel overrides take precedence over guild overrides, and commands are enabled by default.
+
+    Parameters
+    ----------
+    client: cmdClient
+        The client providing the command and module ordinals.
+    """
+    def __init__(self, client):
+        self.client = client
+        self.guilds = {}  # {guildid: _ScopeOverrides}
+
+        # Incremented on every change, for invalidating dependent caches
+        self.version = 0
+
+    def _scope(self, guildid, channelid, create=False):
+        guild = self.guilds.get(guildid, None)
+        if guild is None:
+            if not create:
+                return None
+            guild = self.guilds[guildid] = _ScopeOverrides()
+        if channelid is None:
+            return guild
+
+        channel = guild.channels.get(channelid, None) if guild.channels else None
+        if channel is None and create:
+            if guild.channels is None:
+                guild.channels = {}
+            channel = guild.channels[channelid] = _ScopeOverrides()
+        return channel
+
+    def set(self, guildid, channelid, name, enabled, module=False):
+        """
+        Set an override for a command or module in a guild, or a channel of a guild.
+
+        Parameters
+        ----------
+        guildid: int
+            The guild to set the override in.
+        channelid: Optional[int]
+            The channel to set the override in, or `None` for a guild override.
+        name: str
+            The name of the command, or of the module if `module` is set.
+            Command aliases are resolved, and unknown names are ignored.
+        enabled: Optional[bool]
+            Whether the command or module is enabled, or `None` to clear the override.
+        module: bool
+            Whether `name` refers to a module.
+        """
+        if not self._set(guildid, channelid, name, enabled, module):
+            log("Ignoring override for unknown {} '{}'.".format("module" if module else "command", name),
+                context="OVERRIDES",
+                level=logging.WARNING)
+        self.version += 1
+
+    def _set(self, guildid, channelid, name, enabled, module):
+        """
+        Set an override, returning `False` if the command or module is unknown.
+        Unknown names are not assigned ordinals, since ordinals are never reclaimed and size every bitset.
+        """
+        if module:
+            if not any(mod.name == name for mod in self.client.modules):
+                return False
+            bit = 1 << self.client.module_ordinal(name)
+        else:
+            cmd = self.client.cmd_names.get(name, None)
+            if cmd is None:
+                return False
+            bit = 1 << self.client.cmd_ordinal(cmd.name)
+
+        scope = self._scope(guildid, channelid, create=enabled is not None)
+        if scope is not None:
+            scope.set(bit, enabled, module=module)
+        return True
+
+    def bulk_load(self, rows, replace=True):
+        """
+        Load many overrides at once, e.g. from a database query on startup.
+
+        Parameters
+        ----------
+        rows: Iterable[Tuple[int, Optional[int], str, bool, bool]]
+            Rows of `(guildid, channelid, name, enabled, module)`, as accepted by `set`.
+            Rows for unknown commands or modules, e.g. removed commands, are skipped.
+        replace: bool
+            Whether to first clear the existing overrides of each guild present in `rows`.
+        """
+        rows = list(rows)
+        if replace:
+            for guildid in set(row[0] for row in rows):
+                self.guilds.pop(guildid, None)
+        unknown = set()
+        for guildid, channelid, name, enabled, module in rows:
+            if not self._set(guildid, channelid, name, enabled, module):
+                unknown.add(name)
+        if unknown:
+            log("Skipped overrides for unknown commands or modules: {}.".format(", ".join(sorted(unknown))),
+                context="OVERRIDES",
+                level=logging.WARNING)
+        self.version += 1
+
+    def invalidate(self, guildid=None, channelid=None):
+        """
+        Drop the overrides of a channel, of a guild and its channels, or of every guild if no guild is given.
+        """
+        if guildid is None:
+            self.guilds.clear()
+        elif channelid is None:
+            self.guilds.pop(guildid, None)
+        else:
+            guild = self.guilds.get(guildid, None)
+            if guild is not None and guild.channels:
+                guild.channels.pop(channelid, None)
+                if guild.empty:
+                    self.guilds.pop(guildid, None)
+        self.version += 1
+
+    def is_enabled(self, cmd, guildid, channelid=None):
+        """
+        Returns whether the given command is enabled in the given guild and channel.
+        """
+        guild = self.guilds.get(guildid, None)
+        if guild is None:
+            return True
+
+        cmd_bit = 1 << cmd.ordinal
+        module_bit = 1 << cmd.module.ordinal
+
+        if guild.channels and channelid in guild.channels:
+            state = guild.channels[channelid].state(cmd_bit, module_bit)
+            if state is not None:
+                return state
+
+        state = guild.state(cmd_bit, module_bit)
+        return state is not False
+
+    def signature(self, guildid):
+        """
+        Returns a hashable summary of the guild level overrides, equal for guilds with equal overrides.
+        """
+        guild = self.guilds.get(guildid, None)
+        return guild.signature if guild is not None else None
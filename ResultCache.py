@@ -0,0 +1,139 @@
+import asyncio
+from cachetools import TTLCache
+
+from .Check import FailedCheck
+from .lib import flag_parser
+
+
+class ResultCache(object):
+    """
+    A TTL and size bounded LRU cache of command replies, for idempotent commands.
+    Concurrent identical invocations are coalesced onto a single execution,
+    and cache hits replay the recorded replies through `Context.reply`.
+    Only replies made through `Context.reply` are recorded, so cached commands should reply exclusively through it.
+    Results of commands which send files, edit their replies, or wait for user input are not cached.
+
+    Parameters
+    ----------
+    ttl: float
+        Number of seconds a cached result remains valid.
+    maxsize: int
+        Maximum number of cached results to keep.
+    scope: Optional[str]
+        One of `None`, "guild", "channel" or "user".
+        Results are only shared between invocations with the same scope.
+    """
+    scopes = (None, "guild", "channel", "user")
+
+    def __init__(self, ttl=60, maxsize=256, scope=None):
+        if scope not in self.scopes:
+            raise ValueError("Unknown cache scope '{}'.".format(scope))
+
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.scope = scope
+
+        self.entries = TTLCache(maxsize, ttl)  # Cached replies, {key: ((content, kwargs), ...)}
+        self.pending = {}  # Executions in progress, {key: asyncio.Future}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def hit_rate(self):
+        """
+        Proportion of lookups served without executing the command.
+        """
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache metrics.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': self.hit_rate,
+            'size': len(self.entries)
+        }
+
+    def clear(self):
+        self.entries.clear()
+
+    def scope_id(self, ctx):
+        if self.scope == "guild":
+            return ctx.guild.id if ctx.guild else ctx.ch.id
+        elif self.scope == "channel":
+            return ctx.ch.id
+        elif self.scope == "user":
+            return ctx.author.id
+        return None
+
+    def key(self, ctx):
+        """
+        Build the cache key for the given context.
+        Whitespace in the arguments is normalised, and flags are ordered.
+        """
+        flags = ()
+        args = ctx.arg_str
+        if ctx.cmd.flags:
+            flag_values, args = flag_parser(args, ctx.cmd.flags)
+            flags = tuple(sorted(flag_values.items()))
+        return (ctx.cmd.name, self.scope_id(ctx), " ".join(args.split()), flags)
+
+    async def run(self, ctx, execute):
+        """
+        Run the awaitable function `execute` in the given context, or replay a cached result.
+        """
+        key = self.key(ctx)
+
+        replies = self.entries.get(key, None)
+        if replies is not None:
+            self.hits += 1
+            await self.replay(ctx, replies)
+            return
+
+        pending = self.pending.get(key, None)
+        if pending is not None:
+            self.coalesced += 1
+            replies = await asyncio.shield(pending)
+            if replies is not None:
+                await self.replay(ctx, replies)
+            else:
+                # The shared execution failed or was uncacheable, run independently
+                await execute(ctx)
+            return
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self.pending[key] = future
+        ctx.reply_log = []
+        try:
+            await execute(ctx)
+        except BaseException:
+            future.set_result(None)
+            raise
+        else:
+            # Results without replies are not cached, e.g. if the command sent through the channel directly
+            replies = tuple(ctx.reply_log) if ctx.reply_log else None
+            if replies is not None:
+                self.entries[key] = replies
+            future.set_result(replies)
+        finally:
+            self.pending.pop(key, None)
+            ctx.reply_log = None
+
+    async def replay(self, ctx, replies):
+        """
+        Replay cached replies in the given context.
+        The command checks are evaluated first, since the command function is not run.
+        """
+        for check, args, kwargs in getattr(ctx.cmd.func, 'checks', ()):
+            if not await check.run(ctx, *args, **kwargs):
+                raise FailedCheck(check)
+
+        for content, kwargs in replies:
+            await ctx.reply(content, allow_everyone=True, **kwargs)
@@ -0,0 +1,245 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+from .logger import log
+
+
+class TokenBucket(object):
+    """
+    Local token bucket allowing `rate` sends every `per` seconds.
+    """
+    __slots__ = ('rate', 'per', 'tokens', 'updated')
+
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Attempt to take a token.
+        Returns `0` on success, otherwise the number of seconds until a token is available.
+        """
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def release(self):
+        self.tokens = min(self.rate, self.tokens + 1)
+
+    @property
+    def time_to_full(self):
+        self.refill()
+        return (self.rate - self.tokens) * self.per / self.rate
+
+
+class _Outgoing(object):
+    """
+    A pending outbound message, possibly merged from several replies.
+    """
+    __slots__ = ('ctx', 'content', 'kwargs', 'futures', 'queued_at', 'merge')
+
+    def __init__(self, ctx, content, kwargs, future, merge=True):
+        self.ctx = ctx
+        self.content = content
+        self.kwargs = kwargs
+        self.futures = [future]
+        self.queued_at = time.monotonic()
+        self.merge = merge
+
+    @property
+    def mergeable(self):
+        return self.merge and self.content is not None and not self.kwargs
+
+
+class _ChannelQueue(object):
+    __slots__ = ('items', 'current', 'bucket', 'worker', 'wakeup')
+
+    def __init__(self, bucket):
+        self.items = deque()
+        self.current = None  # The item being sent
+        self.bucket = bucket
+        self.worker = None
+        self.wakeup = asyncio.Event()  # Set when an item is queued
+
+
+class SendQueue(object):
+    """
+    Outbound message pipeline with one paced queue per channel.
+    Used by `Context.reply` when set as the client `send_queue`.
+
+    Parameters
+    ----------
+    rate: int
+        Number of messages which may be sent to a channel every `per` seconds.
+    per: float
+        Period of the per-channel token bucket.
+    coalesce: bool
+        Whether to merge consecutive queued text replies from the same context into one message.
+        Only replies queued while an earlier reply is still waiting to be sent are merged,
+        for example replies queued with `wait=False`, or replies paced by the token bucket.
+    limit: int
+        Maximum length of a merged message.
+    """
+    def __init__(self, rate=5, per=5.0, coalesce=True, limit=2000):
+        self.rate = rate
+        self.per = per
+        self.coalesce = coalesce
+        self.limit = limit
+
+        self.queues = {}  # Active channel queues, {channelid: _ChannelQueue}
+
+        # Metrics
+        self.sent = 0
+        self.merged = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def stats(self):
+        """
+        Returns a dictionary of the pipeline metrics, with latencies in seconds.
+        """
+        return {
+            'sent': self.sent,
+            'merged': self.merged,
+            'queued': sum(len(queue.items) for queue in self.queues.values()),
+            'mean_latency': self.total_latency / self.sent if self.sent else 0,
+            'max_latency': self.max_latency
+        }
+
+    async def send(self, ctx, content=None, wait=True, merge=True, **kwargs):
+        """
+        Queue a message to be sent to the context channel.
+        The sent message is added to `ctx.sent_messages`.
+        If `wait` is set, waits until the message is sent and returns it,
+        otherwise returns `None` immediately, allowing subsequent replies to be merged.
+        The returned message may be shared with merged replies,
+        so messages which will be edited should be sent with `merge` unset to keep them separate.
+        """
+        queue = self.queues.get(ctx.ch.id, None)
+        if queue is None:
+            queue = self.queues[ctx.ch.id] = _ChannelQueue(TokenBucket(self.rate, self.per))
+
+        future = asyncio.get_event_loop().create_future()
+
+        tail = queue.items[-1] if queue.items else None
+        if (self.coalesce and merge and content and not kwargs and tail is not None
+                and tail.ctx is ctx and tail.mergeable
+                and len(tail.content) + len(content) + 1 <= self.limit):
+            tail.content = "{}\n{}".format(tail.content, content)
+            tail.futures.append(future)
+            self.merged += 1
+        else:
+            queue.items.append(_Outgoing(ctx, content, kwargs, future, merge=merge))
+
+        queue.wakeup.set()
+        if queue.worker is None:
+            queue.worker = asyncio.ensure_future(self._process(ctx.ch.id, queue))
+
+        if wait:
+            return await future
+        future.add_done_callback(self._log_failure)
+
+    def cancel(self, ctx):
+        """
+        Drop the queued messages of the given context, e.g. when its command is cancelled.
+        A message which is already being sent is not affected.
+        Returns the number of dropped messages.
+        """
+        queue = self.queues.get(ctx.ch.id, None)
+        if queue is None:
+            return 0
+        dropped = [item for item in queue.items if item.ctx is ctx]
+        if dropped:
+            queue.items = deque(item for item in queue.items if item.ctx is not ctx)
+            for item in dropped:
+                for future in item.futures:
+                    future.cancel()
+        return len(dropped)
+
+    async def join(self, ctx):
+        """
+        Wait until the queued messages of the given context have been sent, dropped or failed,
+        so that `ctx.sent_messages` is complete.
+        """
+        queue = self.queues.get(ctx.ch.id, None)
+        if queue is None:
+            return
+        items = list(queue.items)
+        if queue.current is not None:
+            items.append(queue.current)
+        futures = [future for item in items if item.ctx is ctx for future in item.futures]
+        if futures:
+            await asyncio.wait(futures)
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            log("Failed to send a queued message: {!r}".format(future.exception()),
+                level=logging.WARNING)
+
+    async def _process(self, channelid, queue):
+        """
+        Send the queued messages for a channel in order, pacing against the channel bucket.
+        Exits once the queue is empty and the bucket has refilled.
+        """
+        try:
+            while True:
+                if not queue.items:
+                    # Keep the bucket alive until it refills so bursts are still paced, waking for new items
+                    queue.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(queue.wakeup.wait(), queue.bucket.time_to_full)
+                    except asyncio.TimeoutError:
+                        pass
+                    if not queue.items:
+                        break
+                    continue
+
+                delay = queue.bucket.acquire()
+                if delay:
+                    await asyncio.sleep(delay)
+                    continue
+
+                item = queue.items.popleft()
+                if all(future.cancelled() for future in item.futures):
+                    queue.bucket.release()
+                    continue
+
+                latency = time.monotonic() - item.queued_at
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+                queue.current = item
+                try:
+                    message = await item.ctx.ch.send(content=item.content, **item.kwargs)
+                except Exception as e:
+                    for future in item.futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    self.sent += 1
+                    item.ctx.sent_messages.append(message)
+                    for future in item.futures:
+                        if not future.done():
+                            future.set_result(message)
+                finally:
+                    queue.current = None
+        except Exception:
+            log("Exception encountered processing send queue for channel {}.".format(channelid),
+                level=logging.ERROR)
+            raise
+        finally:
+            queue.worker = None
+            if not queue.items:
+                self.queues.pop(channelid, None)
@@ -3,5 +3,11 @@ from .cmdClient import cmdClient, cmd
 from .Module import Module
 from .Command import Command
 from .Context import Context
+from .ResultCache import ResultCache
+from .SendQueue import SendQueue
+from .HelpIndex import HelpIndex
+from .CircuitBreaker import CircuitBreaker
 from .logger import log
 from . import lib
+from . import tracing
+from .usage import UsageRecorder
@@ -0,0 +1,36 @@
+"""
+Throughput benchmark of `lib.sterilise_content` against the original implementation.
+
+Run from the repository root with `python bench/bench_sterilise.py`.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import conftest  # noqa: F401,E402  Registers the `cmdClient` package
+from cmdClient.lib import sterilise_content  # noqa: E402
+from test_sterilise import reference_sterilise_content  # noqa: E402
+
+
+CASES = {
+    'short, no @': "Your balance is 1234 coins.",
+    'paged, no @': "Row 1234: some leaderboard entry text\n" * 1500,
+    'paged, with @': "Row 1234: user@example.com entry text\n" * 1500,
+    'paged, with ping': "Row 1234: @everyone entry text\n" * 1500,
+    'paged, non-ascii with @': "Ligne 1234: élève@example.com entrée\n" * 1500,
+}
+
+
+def main(number=200):
+    print("{:<26} {:>12} {:>12} {:>8}".format("case", "old (MB/s)", "new (MB/s)", "speedup"))
+    for name, content in CASES.items():
+        size = len(content.encode()) * number / 1e6
+        old = timeit.timeit(lambda: reference_sterilise_content(content), number=number)
+        new = timeit.timeit(lambda: sterilise_content(content), number=number)
+        print("{:<26} {:>12.1f} {:>12.1f} {:>7.1f}x".format(name, size / old, size / new, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,11 @@ import os
 import traceback
 import logging
 import asyncio
+import time
 import itertools
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from cachetools import LRUCache
 from typing import ClassVar, Type, Optional
 from bisect import bisect
@@ -14,6 +18,11 @@ import discord
 from .logger import log
 from .Context import Context
 from .Module import Module
+from .Overrides import OverrideIndex
+from .HelpIndex import HelpIndex
+from .ErrorAggregator import ErrorAggregator
+from .tracing import span
+from .converters import LookupIndex
 
 
 class cmdClient(discord.Client):
@@ -26,7 +35,15 @@ class cmdClient(discord.Client):
 
     cmd_names = {}  # Command name cache, {cmdname: Command}, including aliases.
 
-    def __init__(self, prefix=None, owners=None, ctx_cache=None, baseContext: Type[Context] = Context, **kwargs):
+    cmd_ordinals = {}  # Stable command ordinals, {cmdname: int}, excluding aliases.
+    module_ordinals = {}  # Stable module ordinals, {modulename: int}
+
+    cmd_version = 0  # Incremented whenever the command name cache is updated
+
+    def __init__(self, prefix=None, owners=None, ctx_cache=None, baseContext: Type[Context] = Context,
+                 executor_workers=None, send_queue=None, recorder=None,
+                 shutdown_timeout=30, drain_message=None, command_timeout=None, tracer=None, usage=None,
+                 **kwargs):
         super().__init__(**kwargs)
         self.prefix = prefix
         self.owners = owners or []
@@ -39,6 +56,35 @@ class cmdClient(discord.Client):
 
         self.extra_message_parsers = []
 
+        self.overrides = OverrideIndex(self)  # Per-guild and per-channel command overrides
+        self.help_index = HelpIndex(self)  # Pre-rendered help pages and command lookup
+        self.errors = ErrorAggregator()  # Aggregated unexpected command exceptions
+
+        self.lookup = LookupIndex(self)  # Per-guild member, role and channel name indexes for argument conversion
+
+        self.command_timeout = command_timeout  # Default time budget in seconds for commands
+
+        self.executor_workers = executor_workers  # Pool size for offloaded commands, `None` for the default
+        self.executors = {}  # Lazily created executor pools, {kind: Executor}
+
+        self.send_queue = send_queue  # Optional `SendQueue` for outbound replies
+
+        self.input_waiters = {}  # Pending interactive input, {(channelid, userid): deque[asyncio.Future]}
+
+        self.recorder = recorder  # Optional `TrafficRecorder` for inbound message events
+        self.tracer = tracer  # Optional `Tracer` for command invocations
+
+        self.shutdown_timeout = shutdown_timeout  # Seconds active commands may run for while draining
+        self.drain_message = drain_message  # Optional reply to commands rejected while draining
+        self.draining = False
+        self.drain_hooks = []  # Functions executed after draining, [Function(Client)]
+        self._drain_future = None
+        self.add_drain_hook(self.errors.on_drain)
+
+        self.usage = usage  # Optional `UsageRecorder` for command usage analytics
+        if usage is not None:
+            self.add_drain_hook(usage.on_drain)
+
     @property
     def cmds(self):
         """
@@ -72,11 +118,33 @@ class cmdClient(discord.Client):
         cmds = {}
         for module in cls.modules:
             if module.enabled:
+                module.ordinal = cls.module_ordinal(module.name)
                 for cmd in module.cmds:
+                    cmd.ordinal = cls.cmd_ordinal(cmd.name)
                     cmds[cmd.name] = cmd
                     for alias in cmd.aliases:
                         cmds[alias] = cmd
         cls.cmd_names = cmds
+        cls.cmd_version += 1
+
+    @classmethod
+    def cmd_ordinal(cls, name):
+        """
+        Returns the stable ordinal of the command with the given name, assigning one if required.
+        Ordinals are never reused, even if the command is removed.
+        """
+        if name not in cls.cmd_ordinals:
+            cls.cmd_ordinals[name] = len(cls.cmd_ordinals)
+        return cls.cmd_ordinals[name]
+
+    @classmethod
+    def module_ordinal(cls, name):
+        """
+        Returns the stable ordinal of the module with the given name, assigning one if required.
+        """
+        if name not in cls.module_ordinals:
+            cls.module_ordinals[name] = len(cls.module_ordinals)
+        return cls.module_ordinals[name]
 
     async def valid_prefixes(self, message):
         if self.prefix:
@@ -149,6 +217,9 @@ class cmdClient(discord.Client):
                     if after.id in self.active_contexts and self.active_contexts[after.id].tasks:
                         ctx = self.active_contexts[after.id]
                         [task.cancel() for task in ctx.tasks]
+                        # Drop the replies still waiting to be sent, so they are not posted after the cleanup
+                        if self.send_queue is not None:
+                            self.send_queue.cancel(ctx)
                         # Wait for the task to be removed from active contexts
                         while after.id in self.active_contexts:
                             await asyncio.sleep(0.1)
@@ -187,9 +258,11 @@ class cmdClient(discord.Client):
         If the message contains a valid command, pass the message to run_cmd
         """
         content = message.content.strip()
+        trace = self.tracer.start(message) if self.tracer is not None else None
 
         # Get valid prefixes
-        prefixes = await self.valid_prefixes(message)
+        with span(trace, "valid_prefixes"):
+            prefixes = await self.valid_prefixes(message)
 
         # Check whether the message starts with a valid prefix
         prefixes = [prefix for prefix in prefixes if content.startswith(prefix)]
@@ -201,14 +274,28 @@ class cmdClient(discord.Client):
 
                 if cmdnames:
                     cmdname = max(cmdnames, key=len)
-                    await self.run_cmd(message, cmdname, stripcontent[len(cmdname):].strip(), prefix)
+
+                    # Treat commands disabled in this guild or channel as regular messages
+                    if message.guild is not None and not self.overrides.is_enabled(
+                            self.cmd_names[cmdname], message.guild.id, message.channel.id):
+                        log("Ignoring command '{}' disabled in this guild or channel.".format(cmdname),
+                            context="mid:{}".format(message.id),
+                            level=logging.DEBUG)
+                        break
+
+                    try:
+                        await self.run_cmd(message, cmdname, stripcontent[len(cmdname):].strip(), prefix,
+                                           trace=trace)
+                    finally:
+                        if trace is not None:
+                            self.tracer.finish(trace)
                     return
 
         # Run the extra message parsers
         for parser in self.extra_message_parsers:
             asyncio.ensure_future(parser[0](self, message), loop=self.loop)
 
-    async def run_cmd(self, message, cmdname, arg_str, prefix):
+    async def run_cmd(self, message, cmdname, arg_str, prefix, trace=None):
         """
         Run a command and pass it the command message and the arg_str.
 
@@ -220,6 +307,8 @@ class cmdClient(discord.Client):
             The name of the command to execute.
         arg_str: str
             The remaining content of the command message after the prefix and command name.
+        trace: Optional[Trace]
+            The trace of the command message, if it is being traced.
         """
         cmd = self.cmd_names[cmdname]
         log(("Executing command '{cmdname}' from module '{module}' "
@@ -234,6 +323,13 @@ class cmdClient(discord.Client):
                  content='\n'.join(('\t' + line for line in message.content.splitlines()))),
             context="mid:{}".format(message.id))
 
+        if self.draining:
+            log("Rejecting command since the client is draining.",
+                context="mid:{}".format(message.id))
+            if self.drain_message:
+                await message.channel.send(self.drain_message)
+            return
+
         if not cmd.module.enabled:
             log("Skipping command due to disabled module.",
                 context="mid:{}".format(message.id))
@@ -246,14 +342,18 @@ class cmdClient(discord.Client):
             arg_str=arg_str,
             alias=cmdname,
             cmd=cmd,
-            prefix=prefix
+            prefix=prefix,
+            trace=trace
         )
 
         # Add command to command cache and active contexts
         self.ctx_cache[message.id] = ctx.flatten()
         self.active_contexts[message.id] = ctx
+        outcome = "error"
+        start = time.perf_counter()
         try:
-            await cmd.run(ctx)
+            with span(trace, "run_cmd", cmd=cmd.name):
+                outcome = await cmd.run(ctx)
         except Exception:
             log("The following exception was encountered executing command '{}'.\n{}".format(
                     cmdname,
@@ -261,12 +361,190 @@ class cmdClient(discord.Client):
                 context="mid:{}".format(message.id),
                 level=logging.ERROR)
         finally:
+            # Wait for any unawaited replies, so the cached context records every sent message
+            if self.send_queue is not None:
+                await self.send_queue.join(ctx)
+
             # Renew command in command cache
             self.ctx_cache[message.id] = ctx.flatten()
 
             # Remove message from active contexts
             self.active_contexts.pop(message.id, None)
 
+            if self.usage is not None:
+                self.usage.record(
+                    cmd.name,
+                    message.guild.id if message.guild else None,
+                    message.author.id,
+                    time.perf_counter() - start,
+                    outcome
+                )
+
+    def get_executor(self, kind):
+        """
+        Returns the executor pool of the given `kind`, creating it if it does not exist.
+
+        Parameters
+        ----------
+        kind: str
+            Either "thread" or "process".
+        """
+        if kind not in self.executors:
+            if kind == "thread":
+                self.executors[kind] = ThreadPoolExecutor(max_workers=self.executor_workers)
+            elif kind == "process":
+                self.executors[kind] = ProcessPoolExecutor(max_workers=self.executor_workers)
+            else:
+                raise ValueError("Unknown executor kind '{}'.".format(kind))
+            log("Created {} executor pool.".format(kind))
+        return self.executors[kind]
+
+    async def run_in_executor(self, kind, func, *args, **kwargs):
+        """
+        Run `func` with the given arguments in the executor pool of the given `kind`.
+        The arguments and result must be picklable for process pools.
+        """
+        return await self.loop.run_in_executor(
+            self.get_executor(kind),
+            functools.partial(func, *args, **kwargs)
+        )
+
+    def timeout_stats(self):
+        """
+        Returns the number of timed out invocations for each command which has timed out.
+        """
+        return {cmd.name: cmd.timeouts for cmd in self.cmds if cmd.timeouts}
+
+    def cache_stats(self):
+        """
+        Returns the result cache metrics for each command with a cache.
+        """
+        return {cmd.name: cmd.cache.stats() for cmd in self.cmds if cmd.cache is not None}
+
+    def error_summary(self):
+        """
+        Returns a list of the unexpected command exceptions seen, most frequent first.
+        """
+        return self.errors.summary()
+
+    def shutdown_executors(self):
+        """
+        Shut down the executor pools without waiting for pending work.
+        """
+        for kind, executor in self.executors.items():
+            log("Shutting down {} executor pool.".format(kind))
+            executor.shutdown(wait=False)
+        self.executors = {}
+
+    def add_drain_hook(self, func):
+        """
+        Decorator which adds a coroutine function to execute once the client has drained.
+        Intended for flushing caches and metrics before shutdown.
+        The function must take the client as its only argument.
+        """
+        self.drain_hooks.append(func)
+        log("Adding drain hook \"{}\"".format(func.__name__))
+        return func
+
+    async def drain(self, timeout=None):
+        """
+        Stop accepting new commands and wait for the active commands to complete.
+        Command tasks which are still running after `timeout` seconds are cancelled.
+        The drain hooks are executed afterwards.
+        Repeated calls wait for the same drain.
+
+        Parameters
+        ----------
+        timeout: Optional[float]
+            Deadline for active commands, defaulting to `shutdown_timeout`.
+        """
+        if self._drain_future is None:
+            self.draining = True
+            self._drain_future = asyncio.ensure_future(self._drain(
+                self.shutdown_timeout if timeout is None else timeout,
+                asyncio.current_task()
+            ))
+        await asyncio.shield(self._drain_future)
+
+    async def _drain(self, timeout, caller):
+        # Don't wait for the caller, e.g. if a command is shutting down the client
+        tasks = [
+            task
+            for ctx in list(self.active_contexts.values())
+            for task in ctx.tasks
+            if task is not caller and not task.done()
+        ]
+        if tasks:
+            log("Draining {} active command tasks with a deadline of {} seconds.".format(len(tasks), timeout))
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            if pending:
+                log("Cancelling {} command tasks which did not complete before the deadline.".format(len(pending)),
+                    level=logging.WARNING)
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending, timeout=1)
+
+        for hook in self.drain_hooks:
+            try:
+                await hook(self)
+            except Exception:
+                log("Exception encountered executing drain hook '{}'.\n{}".format(
+                        hook.__name__,
+                        traceback.format_exc()),
+                    level=logging.ERROR)
+        log("Client drained.")
+
+    async def close(self):
+        await self.drain()
+        await super().close()
+        self.shutdown_executors()
+        if self.recorder is not None:
+            await self.recorder.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+    def add_input_waiter(self, channelid, userid):
+        """
+        Register a waiter for the next message from the given user in the given channel.
+        Returns a future which will be resolved with the message.
+        Waiters on the same channel and user are resolved in order of registration.
+        """
+        future = self.loop.create_future()
+        key = (channelid, userid)
+        if key not in self.input_waiters:
+            self.input_waiters[key] = deque()
+        self.input_waiters[key].append(future)
+        return future
+
+    def remove_input_waiter(self, channelid, userid, future):
+        """
+        Remove a waiter registered with `add_input_waiter`, if it is still pending.
+        """
+        key = (channelid, userid)
+        waiters = self.input_waiters.get(key, None)
+        if waiters is not None:
+            try:
+                waiters.remove(future)
+            except ValueError:
+                pass
+            if not waiters:
+                self.input_waiters.pop(key, None)
+
+    def route_input(self, message):
+        """
+        Resolve the first pending input waiter matching the message channel and author, if any.
+        """
+        key = (message.channel.id, message.author.id)
+        waiters = self.input_waiters.get(key, None)
+        if waiters is not None:
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(message)
+                    break
+            if not waiters:
+                self.input_waiters.pop(key, None)
+
     def load_dir(self, dirpath):
         """
         Import all modules in a directory.
@@ -370,6 +648,10 @@ class cmdClient(discord.Client):
             return wrapper(func)
 
     def dispatch(self, event, *args, **kwargs):
+        if self.recorder is not None:
+            self.recorder.record(event, *args)
+        if event == "message" and self.input_waiters:
+            self.route_input(args[0])
         super().dispatch(event, *args, **kwargs)
         after_handler = "after_"+event
         if hasattr(self, after_handler):
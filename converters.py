@@ -0,0 +1,384 @@
+"""
+Typed argument conversion for commands, driven by the annotations of the command function.
+
+Command functions may declare annotated parameters after the context, for example
+`async def cmd(ctx, member: discord.Member, amount: int = 1, *, reason: str = None)`.
+Arguments are taken from `ctx.args` after flag parsing, with one word (or quoted string) per positional parameter,
+and the remaining content for a keyword-only or final parameter.
+Unannotated parameters are not filled, so they keep their defaults.
+Member, role and channel arguments are resolved through per-guild name indexes,
+which are built on first use and updated incrementally from gateway events.
+"""
+import re
+import types
+import typing
+import inspect
+from bisect import bisect_left, insort
+
+import discord
+
+from .lib import BadArgument
+
+
+class NameIndex(object):
+    """
+    Case-insensitive exact and prefix index from names to object ids.
+    """
+    __slots__ = ('ids_by_key', 'keys', 'keys_by_id')
+
+    def __init__(self):
+        self.ids_by_key = {}  # {lowercase name: id or Set[id]}
+        self.keys = []  # Sorted lowercase names
+        self.keys_by_id = {}  # {id: Tuple[lowercase name]}
+
+    def __len__(self):
+        return len(self.keys_by_id)
+
+    def _insert(self, objid, names):
+        """
+        Add an object to the name mappings, returning the newly seen names.
+        """
+        keys = tuple(set(name.lower() for name in names if name))
+        self.keys_by_id[objid] = keys
+        new_keys = []
+        for key in keys:
+            ids = self.ids_by_key.get(key, None)
+            if ids is None:
+                # Store single ids directly, since most names are unique
+                self.ids_by_key[key] = objid
+                new_keys.append(key)
+            elif isinstance(ids, set):
+                ids.add(objid)
+            elif ids != objid:
+                self.ids_by_key[key] = {ids, objid}
+        return new_keys
+
+    def add(self, objid, names):
+        for key in self._insert(objid, names):
+            insort(self.keys, key)
+
+    def build(self, items):
+        """
+        Add many `(id, names)` pairs at once, sorting the names a single time.
+        """
+        for objid, names in items:
+            self._insert(objid, names)
+        self.keys = sorted(self.ids_by_key)
+
+    def remove(self, objid):
+        for key in self.keys_by_id.pop(objid, ()):
+            ids = self.ids_by_key[key]
+            if isinstance(ids, set):
+                ids.discard(objid)
+                if len(ids) == 1:
+                    self.ids_by_key[key] = ids.pop()
+            else:
+                del self.ids_by_key[key]
+                del self.keys[bisect_left(self.keys, key)]
+
+    def update(self, objid, names):
+        if tuple(set(name.lower() for name in names if name)) != self.keys_by_id.get(objid, None):
+            self.remove(objid)
+            self.add(objid, names)
+
+    def exact(self, name):
+        """
+        Returns the list of ids with the given name.
+        """
+        ids = self.ids_by_key.get(name.lower(), None)
+        if ids is None:
+            return []
+        return list(ids) if isinstance(ids, set) else [ids]
+
+    def prefix(self, prefix, limit=10):
+        """
+        Returns up to `limit` ids with a name starting with the given prefix.
+        """
+        prefix = prefix.lower()
+        result = []
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and self.keys[i].startswith(prefix) and len(result) < limit:
+            ids = self.ids_by_key[self.keys[i]]
+            for objid in (ids if isinstance(ids, set) else (ids,)):
+                if objid not in result:
+                    result.append(objid)
+            i += 1
+        return result[:limit]
+
+
+class LookupIndex(object):
+    """
+    Per-guild name indexes of members, roles and channels.
+    The indexes of a guild are built on first use, and then kept up to date from the gateway events
+    registered by `attach`. The event handlers are only attached once the first index is built,
+    so clients which never convert arguments do not handle these events.
+    """
+    kinds = ('members', 'roles', 'channels')
+
+    def __init__(self, client):
+        self.client = client
+        self.attached = False
+        self.guilds = {}  # {guildid: {kind: NameIndex}}
+
+    @staticmethod
+    def member_names(member):
+        return (member.name, member.display_name, str(member))
+
+    @staticmethod
+    def names(obj):
+        return (obj.name,)
+
+    def get(self, guild, kind):
+        """
+        Returns the `NameIndex` of the given kind for the given guild, building the guild indexes if required.
+        Members received by chunking do not fire `member_join`,
+        so the indexes of guilds which are not fully chunked are rebuilt on each use instead of being kept.
+        """
+        indexes = self.guilds.get(guild.id, None)
+        if indexes is None:
+            if not self.attached:
+                self.attach(self.client)
+            indexes = {kind: NameIndex() for kind in self.kinds}
+            indexes['members'].build((member.id, self.member_names(member)) for member in guild.members)
+            indexes['roles'].build((role.id, self.names(role)) for role in guild.roles)
+            indexes['channels'].build((channel.id, self.names(channel)) for channel in guild.channels)
+            if guild.chunked:
+                self.guilds[guild.id] = indexes
+        return indexes[kind]
+
+    def _indexed(self, guild, kind):
+        # Only maintain the indexes of guilds which have been built
+        indexes = self.guilds.get(guild.id, None) if guild is not None else None
+        return indexes[kind] if indexes is not None else None
+
+    def attach(self, client):
+        """
+        Register the event handlers which keep the indexes up to date.
+        """
+        self.attached = True
+
+        async def member_join(client, member):
+            index = self._indexed(member.guild, 'members')
+            if index is not None:
+                index.add(member.id, self.member_names(member))
+
+        async def member_remove(client, member):
+            index = self._indexed(member.guild, 'members')
+            if index is not None:
+                index.remove(member.id)
+
+        async def member_update(client, before, after):
+            index = self._indexed(after.guild, 'members')
+            if index is not None:
+                index.update(after.id, self.member_names(after))
+
+        async def user_update(client, before, after):
+            for guildid, indexes in self.guilds.items():
+                if after.id in indexes['members'].keys_by_id:
+                    guild = client.get_guild(guildid)
+                    member = guild.get_member(after.id) if guild is not None else None
+                    if member is not None:
+                        indexes['members'].update(after.id, self.member_names(member))
+
+        async def object_create(client, obj):
+            index = self._indexed(obj.guild, kind_of(obj))
+            if index is not None:
+                index.add(obj.id, self.names(obj))
+
+        async def object_delete(client, obj):
+            index = self._indexed(obj.guild, kind_of(obj))
+            if index is not None:
+                index.remove(obj.id)
+
+        async def object_update(client, before, after):
+            index = self._indexed(after.guild, kind_of(after))
+            if index is not None:
+                index.update(after.id, self.names(after))
+
+        async def guild_remove(client, guild):
+            self.guilds.pop(guild.id, None)
+
+        def kind_of(obj):
+            return 'roles' if isinstance(obj, discord.Role) else 'channels'
+
+        client.add_after_event("member_join", member_join)
+        client.add_after_event("member_remove", member_remove)
+        client.add_after_event("member_update", member_update)
+        client.add_after_event("user_update", user_update)
+        client.add_after_event("guild_role_create", object_create)
+        client.add_after_event("guild_role_delete", object_delete)
+        client.add_after_event("guild_role_update", object_update)
+        client.add_after_event("guild_channel_create", object_create)
+        client.add_after_event("guild_channel_delete", object_delete)
+        client.add_after_event("guild_channel_update", object_update)
+        client.add_after_event("guild_remove", guild_remove)
+
+
+def _find(ctx, kind, arg, pattern, getter):
+    """
+    Resolve a guild object from a mention, an id, or a (partial) name.
+    """
+    if ctx.guild is None:
+        raise BadArgument("This argument may only be used in a guild!")
+
+    match = re.fullmatch(pattern, arg)
+    if match:
+        obj = getter(int(match.group(1) or match.group(2)))
+        if obj is not None:
+            return obj
+
+    index = ctx.client.lookup.get(ctx.guild, kind)
+    ids = index.exact(arg) or index.prefix(arg, limit=2)
+    if len(ids) == 1:
+        obj = getter(ids[0])
+        if obj is not None:
+            return obj
+    elif len(ids) > 1:
+        raise BadArgument("Multiple {} match `{}`, please be more specific!".format(kind, arg))
+    raise BadArgument("Couldn't find any {} matching `{}`!".format(kind, arg))
+
+
+async def convert_member(ctx, arg):
+    return _find(ctx, 'members', arg, r"<@!?(\d+)>|(\d{15,21})", ctx.guild.get_member if ctx.guild else None)
+
+
+async def convert_role(ctx, arg):
+    return _find(ctx, 'roles', arg, r"<@&(\d+)>|(\d{15,21})", ctx.guild.get_role if ctx.guild else None)
+
+
+async def convert_channel(ctx, arg):
+    return _find(ctx, 'channels', arg.lstrip('#'), r"<#(\d+)>|(\d{15,21})",
+                 ctx.guild.get_channel if ctx.guild else None)
+
+
+def _builtin(type_):
+    async def convert(ctx, arg):
+        try:
+            return type_(arg)
+        except ValueError:
+            raise BadArgument("`{}` is not a valid {}!".format(arg, type_.__name__))
+    return convert
+
+
+async def convert_str(ctx, arg):
+    return arg
+
+
+# Registered converters, {type: Function(Context, str) -> value}
+converters = {
+    str: convert_str,
+    int: _builtin(int),
+    float: _builtin(float),
+    discord.Member: convert_member,
+    discord.Role: convert_role,
+    discord.TextChannel: convert_channel,
+    discord.VoiceChannel: convert_channel,
+    discord.abc.GuildChannel: convert_channel,
+}
+
+
+def register_converter(type_, func):
+    """
+    Register a converter coroutine function `func(ctx, arg)` for parameters annotated with `type_`.
+    Converters should raise `BadArgument` on failure.
+    """
+    converters[type_] = func
+
+
+_union_types = (typing.Union, getattr(types, 'UnionType', typing.Union))
+
+
+def _unwrap_optional(annotation):
+    """
+    Returns `X` for an `Optional[X]` annotation, and the annotation itself otherwise.
+    """
+    if typing.get_origin(annotation) in _union_types:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def command_params(func):
+    """
+    Returns the convertible parameters of a command function, as a list of `(inspect.Parameter, converter)`.
+    Only annotated parameters are converted, excluding the context, the `flags` parameter, and variadic parameters.
+    `Optional` annotations are unwrapped.
+    Raises `TypeError` if a parameter has no registered converter,
+    or if there is more than one keyword-only parameter, since each takes the remaining content.
+    """
+    # Resolve string annotations against the module of the undecorated function
+    unwrapped = inspect.unwrap(func)
+    try:
+        hints = typing.get_type_hints(unwrapped)
+    except Exception:
+        # Typically an unresolvable context annotation, resolve the remaining parameters individually
+        hints = None
+    params = list(inspect.signature(func).parameters.values())[1:]
+
+    result = []
+    rest = None
+    for param in params:
+        if param.name == 'flags' or param.kind not in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY):
+            continue
+        if param.annotation is param.empty:
+            # Unannotated parameters are left to the command, e.g. optional parameters of existing commands
+            continue
+        if param.kind == param.KEYWORD_ONLY:
+            if rest is not None:
+                raise TypeError("Parameters '{}' and '{}' of '{}' may not both take the remaining arguments.".format(
+                    rest.name, param.name, func.__name__
+                ))
+            rest = param
+        if hints is not None:
+            annotation = hints.get(param.name, param.annotation)
+        elif isinstance(param.annotation, str):
+            try:
+                annotation = eval(param.annotation, unwrapped.__globals__)
+            except Exception:
+                raise TypeError("Could not resolve the annotation of parameter '{}' of '{}'.".format(
+                    param.name, func.__name__
+                ))
+        else:
+            annotation = param.annotation
+        annotation = _unwrap_optional(annotation)
+        converter = converters.get(annotation, None)
+        if converter is None:
+            raise TypeError("No converter registered for parameter '{}' of '{}' with annotation {!r}.".format(
+                param.name, func.__name__, annotation
+            ))
+        result.append((param, converter))
+    return result
+
+
+_word_pattern = re.compile(r'"([^"]*)"|(\S+)')
+
+
+async def convert_arguments(ctx, params, args):
+    """
+    Split the argument string and convert each argument with the converters given by `command_params`.
+    Returns a dictionary of keyword arguments for the command function.
+    """
+    kwargs = {}
+    pos = 0
+    for i, (param, converter) in enumerate(params):
+        last = i == len(params) - 1 or param.kind == param.KEYWORD_ONLY
+        if last:
+            arg = args[pos:].strip() or None
+            pos = len(args)
+        else:
+            match = _word_pattern.search(args, pos)
+            if match:
+                arg = match.group(1) if match.group(1) is not None else match.group(2)
+                pos = match.end()
+            else:
+                arg = None
+
+        if arg is None:
+            if param.default is param.empty:
+                raise BadArgument("Missing required argument `{}`!".format(param.name))
+            kwargs[param.name] = param.default
+            continue
+
+        kwargs[param.name] = await converter(ctx, arg)
+    return kwargs
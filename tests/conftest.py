@@ -0,0 +1,13 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Register the repository as the `cmdClient` package without executing its `__init__`,
+# so the modules which do not depend on discord.py can be tested on their own.
+# Pytest imports the repository package under its directory name, so register that name as well.
+package = types.ModuleType('cmdClient')
+package.__path__ = [ROOT]
+for name in {'cmdClient', os.path.basename(ROOT)}:
+    sys.modules.setdefault(name, package)
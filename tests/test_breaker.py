@@ -0,0 +1,79 @@
+import pytest
+
+from cmdClient.lib import CircuitOpen
+from cmdClient.CircuitBreaker import CircuitBreaker
+
+
+def invoke(breaker, outcome):
+    breaker.acquire()
+    breaker.record(outcome)
+
+
+def test_opens_at_failure_threshold():
+    breaker = CircuitBreaker(threshold=0.5, min_calls=4, reset_timeout=60)
+    for outcome in ("success", "error", "success"):
+        invoke(breaker, outcome)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    invoke(breaker, "timeout")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 1
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+def test_does_not_open_below_min_calls():
+    breaker = CircuitBreaker(threshold=0.5, min_calls=4)
+    for _ in range(3):
+        invoke(breaker, "error")
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_ignored_outcomes_are_not_counted():
+    breaker = CircuitBreaker(threshold=0.5, min_calls=2)
+    invoke(breaker, "error")
+    for outcome in ("failed_check", "cancelled_safely", "cancelled") * 3:
+        invoke(breaker, outcome)
+    assert breaker.stats()['calls'] == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    invoke(breaker, "error")
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_closes_breaker():
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=0, probes=2)
+    invoke(breaker, "error")
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # Probes are admitted up to the limit once the reset timeout has passed
+    breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.acquire()
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+    # An ignored outcome releases its probe without closing the breaker
+    breaker.record("cancelled")
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.acquire()
+
+    breaker.record("success")
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()['calls'] == 0
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=0)
+    invoke(breaker, "error")
+    breaker.acquire()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record("timeout")
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 2
+    assert breaker.probing == 0
+
+    breaker.reset_timeout = 60
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
@@ -0,0 +1,117 @@
+from types import SimpleNamespace
+
+from cmdClient.Overrides import OverrideIndex
+
+
+class FakeClient:
+    def __init__(self):
+        self.cmd_ordinals = {}
+        self.module_ordinals = {}
+        self.modules = [SimpleNamespace(name="Fun"), SimpleNamespace(name="Admin")]
+        for module in self.modules:
+            module.ordinal = self.module_ordinal(module.name)
+        fun, admin = self.modules
+        self.cmds = {
+            'ping': self.make_cmd('ping', fun),
+            'roll': self.make_cmd('roll', fun),
+            'ban': self.make_cmd('ban', admin),
+        }
+        self.cmd_names = dict(self.cmds, p=self.cmds['ping'])
+
+    def make_cmd(self, name, module):
+        return SimpleNamespace(name=name, module=module, ordinal=self.cmd_ordinal(name))
+
+    def cmd_ordinal(self, name):
+        return self.cmd_ordinals.setdefault(name, len(self.cmd_ordinals))
+
+    def module_ordinal(self, name):
+        return self.module_ordinals.setdefault(name, len(self.module_ordinals))
+
+
+def test_channel_overrides_take_precedence_over_guild():
+    client = FakeClient()
+    index = OverrideIndex(client)
+    ping = client.cmds['ping']
+    index.set(1, None, 'ping', False)
+    index.set(1, 10, 'ping', True)
+
+    assert not index.is_enabled(ping, 1)
+    assert not index.is_enabled(ping, 1, 11)
+    assert index.is_enabled(ping, 1, 10)
+    assert index.is_enabled(ping, 2, 10)
+
+
+def test_command_overrides_take_precedence_over_module():
+    client = FakeClient()
+    index = OverrideIndex(client)
+    index.set(1, None, 'Fun', False, module=True)
+    index.set(1, None, 'p', True)
+
+    assert index.is_enabled(client.cmds['ping'], 1)
+    assert not index.is_enabled(client.cmds['roll'], 1)
+    assert index.is_enabled(client.cmds['ban'], 1)
+
+    # A channel module override still applies to commands without a command override in the channel
+    index.set(1, 10, 'Fun', True, module=True)
+    assert index.is_enabled(client.cmds['roll'], 1, 10)
+
+    # Clearing the command override falls back to the module override
+    index.set(1, None, 'ping', None)
+    assert not index.is_enabled(client.cmds['ping'], 1)
+
+
+def test_bulk_load_replaces_guild_overrides():
+    client = FakeClient()
+    index = OverrideIndex(client)
+    index.set(1, None, 'ping', False)
+    index.set(1, None, 'ban', False)
+    index.set(2, None, 'ping', False)
+
+    version = index.version
+    index.bulk_load([(1, None, 'roll', False, False), (1, 10, 'ban', True, False)])
+    assert index.version > version
+
+    # The previous overrides of the guild are dropped
+    assert index.is_enabled(client.cmds['ping'], 1)
+    assert index.is_enabled(client.cmds['ban'], 1)
+    assert not index.is_enabled(client.cmds['roll'], 1)
+    # Guilds missing from the rows are kept
+    assert not index.is_enabled(client.cmds['ping'], 2)
+
+    index.bulk_load([(1, None, 'ping', False, False)], replace=False)
+    assert not index.is_enabled(client.cmds['ping'], 1)
+    assert not index.is_enabled(client.cmds['roll'], 1)
+
+
+def test_unknown_names_are_not_assigned_ordinals():
+    client = FakeClient()
+    index = OverrideIndex(client)
+    ordinals = dict(client.cmd_ordinals)
+    index.bulk_load([(1, None, 'pnig', False, False), (1, None, 'removed', False, False),
+                     (1, None, 'Missing', False, True)])
+    index.set(1, None, 'typo', False)
+
+    assert client.cmd_ordinals == ordinals
+    assert len(client.module_ordinals) == 2
+    assert all(index.is_enabled(cmd, 1) for cmd in client.cmds.values())
+
+
+def test_invalidate():
+    client = FakeClient()
+    index = OverrideIndex(client)
+    ping = client.cmds['ping']
+    index.set(1, None, 'ping', False)
+    index.set(1, 10, 'ping', True)
+    index.set(2, None, 'ping', False)
+
+    index.invalidate(1, 10)
+    assert not index.is_enabled(ping, 1, 10)
+
+    index.invalidate(1)
+    assert index.is_enabled(ping, 1)
+    assert not index.is_enabled(ping, 2)
+
+    version = index.version
+    index.invalidate()
+    assert index.is_enabled(ping, 2)
+    assert index.version > version
@@ -0,0 +1,135 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from cmdClient.Check import Check, FailedCheck
+from cmdClient.ResultCache import ResultCache
+
+
+class FakeContext:
+    def __init__(self, func, arg_str="", authorid=1):
+        self.cmd = SimpleNamespace(name="cmd", flags=[], func=func)
+        self.arg_str = arg_str
+        self.guild = SimpleNamespace(id=10)
+        self.ch = SimpleNamespace(id=20)
+        self.author = SimpleNamespace(id=authorid)
+        self.trace = None
+        self.reply_log = None
+        self.replies = []
+
+    async def reply(self, content=None, allow_everyone=False, **kwargs):
+        # Mirrors the reply recording of `Context.reply`
+        if self.reply_log is not None:
+            self.reply_log.append((content, kwargs))
+        self.replies.append(content)
+
+
+class Counter:
+    def __init__(self, delay=0, cacheable=True):
+        self.calls = 0
+        self.delay = delay
+        self.cacheable = cacheable
+
+    async def __call__(self, ctx):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        await ctx.reply("result {}".format(ctx.arg_str))
+        if not self.cacheable:
+            # As done by `Context.input` for interactive sessions
+            ctx.reply_log = None
+
+
+async def command(ctx):
+    pass
+
+
+def test_hits_replay_cached_replies():
+    async def run():
+        cache = ResultCache()
+        execute = Counter()
+        first = FakeContext(command, "a  b")
+        second = FakeContext(command, "a b")
+        other = FakeContext(command, "c")
+        for ctx in (first, second, other):
+            await cache.run(ctx, execute)
+        return cache, execute, first, second, other
+
+    cache, execute, first, second, other = asyncio.run(run())
+    assert execute.calls == 2
+    assert second.replies == first.replies == ["result a  b"]
+    assert other.replies == ["result c"]
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+    assert second.reply_log is None
+
+
+def test_concurrent_invocations_are_coalesced():
+    async def run():
+        cache = ResultCache()
+        execute = Counter(delay=0.05)
+        contexts = [FakeContext(command, "x") for _ in range(3)]
+        await asyncio.gather(*(cache.run(ctx, execute) for ctx in contexts))
+        return cache, execute, contexts
+
+    cache, execute, contexts = asyncio.run(run())
+    assert execute.calls == 1
+    assert all(ctx.replies == ["result x"] for ctx in contexts)
+    assert cache.coalesced == 2
+    assert not cache.pending
+
+
+def test_uncacheable_results_are_not_shared():
+    async def run():
+        cache = ResultCache()
+        execute = Counter(delay=0.05, cacheable=False)
+        first, second = FakeContext(command, "x"), FakeContext(command, "x")
+        # The coalesced invocation runs independently once the shared execution turns out uncacheable
+        await asyncio.gather(cache.run(first, execute), cache.run(second, execute))
+        third = FakeContext(command, "x")
+        await cache.run(third, execute)
+        return cache, execute, third
+
+    cache, execute, third = asyncio.run(run())
+    assert execute.calls == 3
+    assert third.replies == ["result x"]
+    assert len(cache.entries) == 0
+
+
+def test_failed_execution_is_not_cached():
+    async def run():
+        cache = ResultCache()
+
+        async def execute(ctx):
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            await cache.run(FakeContext(command), execute)
+        return cache
+
+    cache = asyncio.run(run())
+    assert len(cache.entries) == 0
+    assert not cache.pending
+
+
+def test_replay_runs_checks():
+    async def is_first_user(ctx):
+        return ctx.author.id == 1
+
+    checked = Check("first_user", "Not allowed!", is_first_user)()(command)
+
+    async def run():
+        cache = ResultCache()
+        execute = Counter()
+        await cache.run(FakeContext(checked, "x", authorid=1), execute)
+        denied = FakeContext(checked, "x", authorid=2)
+        with pytest.raises(FailedCheck):
+            await cache.run(denied, execute)
+        allowed = FakeContext(checked, "x", authorid=1)
+        await cache.run(allowed, execute)
+        return execute, denied, allowed
+
+    execute, denied, allowed = asyncio.run(run())
+    assert execute.calls == 1
+    assert denied.replies == []
+    assert allowed.replies == ["result x"]
@@ -0,0 +1,131 @@
+import time
+import asyncio
+
+from cmdClient.SendQueue import SendQueue
+
+
+class FakeChannel:
+    id = 1
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append((time.monotonic(), content, kwargs))
+        return len(self.sent)
+
+
+class FakeContext:
+    def __init__(self, ch):
+        self.ch = ch
+        self.sent_messages = []
+
+
+def test_sequential_sends_are_not_delayed():
+    async def run():
+        queue = SendQueue()
+        ctx = FakeContext(FakeChannel())
+        start = time.monotonic()
+        for i in range(3):
+            await queue.send(ctx, "reply {}".format(i))
+        return time.monotonic() - start, ctx
+
+    elapsed, ctx = asyncio.run(run())
+    assert elapsed < 0.1
+    assert ctx.sent_messages == [1, 2, 3]
+
+
+def test_sends_are_paced_by_bucket():
+    async def run():
+        queue = SendQueue(rate=2, per=0.2, coalesce=False)
+        ch = FakeChannel()
+        ctx = FakeContext(ch)
+        await asyncio.gather(*(queue.send(ctx, "reply {}".format(i)) for i in range(4)))
+        return ch
+
+    ch = asyncio.run(run())
+    times = [sent[0] for sent in ch.sent]
+    assert len(times) == 4
+    # Two tokens are available immediately, the rest are refilled at 0.1s intervals
+    assert times[2] - times[0] >= 0.09
+    assert times[3] - times[0] >= 0.19
+
+
+def test_unawaited_replies_are_merged():
+    async def run():
+        queue = SendQueue()
+        ch = FakeChannel()
+        ctx = FakeContext(ch)
+        await queue.send(ctx, "a", wait=False)
+        await queue.send(ctx, "b", wait=False)
+        message = await queue.send(ctx, "c")
+        return queue, ch, ctx, message
+
+    queue, ch, ctx, message = asyncio.run(run())
+    assert [sent[1] for sent in ch.sent] == ["a\nb\nc"]
+    assert queue.merged == 2
+    assert ctx.sent_messages == [message]
+
+
+def test_merging_respects_limit():
+    async def run():
+        queue = SendQueue(limit=5)
+        ch = FakeChannel()
+        ctx = FakeContext(ch)
+        await asyncio.gather(queue.send(ctx, "aaa"), queue.send(ctx, "bbb"), queue.send(ctx, "c"))
+        return ch
+
+    ch = asyncio.run(run())
+    assert [sent[1] for sent in ch.sent] == ["aaa", "bbb\nc"]
+
+
+def test_cancel_drops_queued_replies():
+    async def run():
+        queue = SendQueue(rate=2, per=0.2, coalesce=False)
+        ch = FakeChannel()
+        ctx = FakeContext(ch)
+        other = FakeContext(ch)
+        for i in range(8):
+            await queue.send(ctx, "reply {}".format(i), wait=False)
+        await queue.send(other, "other", wait=False)
+        # Let the initial burst through, then cancel while the rest are being paced
+        await asyncio.sleep(0.05)
+        dropped = queue.cancel(ctx)
+        await queue.join(ctx)
+        await queue.join(other)
+        return dropped, ch, ctx
+
+    dropped, ch, ctx = asyncio.run(run())
+    assert dropped == 6
+    assert [sent[1] for sent in ch.sent] == ["reply 0", "reply 1", "other"]
+    assert ctx.sent_messages == [1, 2]
+
+
+def test_join_waits_for_unawaited_replies():
+    async def run():
+        queue = SendQueue(rate=1, per=0.1)
+        ch = FakeChannel()
+        ctx = FakeContext(ch)
+        await queue.send(ctx, "a", wait=False)
+        await queue.send(ctx, "b", embed=True, wait=False)
+        await queue.join(ctx)
+        return ctx
+
+    ctx = asyncio.run(run())
+    assert ctx.sent_messages == [1, 2]
+
+
+def test_unmerged_replies_are_kept_separate():
+    async def run():
+        queue = SendQueue()
+        ch = FakeChannel()
+        ctx = FakeContext(ch)
+        await queue.send(ctx, "a", wait=False)
+        page = await queue.send(ctx, "page", merge=False)
+        await queue.send(ctx, "b", wait=False)
+        await queue.send(ctx, "c")
+        return ch, page
+
+    ch, page = asyncio.run(run())
+    assert [sent[1] for sent in ch.sent] == ["a", "page", "b\nc"]
+    assert page == 2
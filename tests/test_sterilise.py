@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from cmdClient.lib import sterilise_content
+
+
+def reference_sterilise_content(content):
+    """
+    The original two pass implementation of `sterilise_content`, used as a test oracle.
+    """
+    content = content.replace("@everyone", "@​everyone")
+    content = content.replace("@here", "@​here")
+    asciimsg = content.encode('ascii', errors='ignore').decode()
+    if "@everyone" in asciimsg or "@here" in asciimsg:
+        content = content.replace("@", "@​")
+
+    return content
+
+
+# Fragments chosen to build pings, partial pings, and pings hidden by non-ascii characters
+FRAGMENTS = [
+    "@", "@@", "@everyone", "@here", "every", "one", "here", "e", "h", "r", "y", "o", "n",
+    " ", "\n", "x", "​", "é", "е", "һ", "🙂", "<@123>"
+]
+
+
+@pytest.mark.parametrize('content', [
+    "",
+    "no mentions here",
+    "@everyone",
+    "@here and @everyone",
+    "@@everyone",
+    "@​everyone",
+    "@eve​ryone",
+    "@évery​one",
+    "@еveryone",
+    "email@example.com",
+    "@ here",
+])
+def test_matches_reference_examples(content):
+    assert sterilise_content(content) == reference_sterilise_content(content)
+
+
+def test_matches_reference_random():
+    rng = random.Random(0)
+    for _ in range(50000):
+        content = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 12)))
+        assert sterilise_content(content) == reference_sterilise_content(content), repr(content)
+
+
+def test_matches_reference_property():
+    hypothesis = pytest.importorskip("hypothesis")
+    strategies = pytest.importorskip("hypothesis.strategies")
+
+    @hypothesis.settings(max_examples=2000, deadline=None)
+    @hypothesis.given(strategies.lists(strategies.sampled_from(FRAGMENTS) | strategies.text(max_size=3)).map("".join))
+    def check(content):
+        assert sterilise_content(content) == reference_sterilise_content(content)
+
+    check()
+
+
+def test_no_mentions_returns_same_object():
+    content = "hello world " * 100
+    assert sterilise_content(content) is content
@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+from cmdClient.traffic import TrafficRecorder, load_events
+
+
+def make_message(msgid, content, authorid=7):
+    return SimpleNamespace(
+        id=msgid,
+        content=content,
+        channel=SimpleNamespace(id=5),
+        guild=SimpleNamespace(id=9),
+        author=SimpleNamespace(id=authorid, bot=False)
+    )
+
+
+def test_anonymise_hashes_mentions_consistently(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    recorder = TrafficRecorder(path, anonymise=True)
+    recorder.record("message", make_message(1, "!ban <@!7> <@&3> <#5> <@7>"))
+    asyncio.run(recorder.close())
+
+    event, = load_events(path)
+    assert event['c'] == "!ban <@!{a}> <@&{r}> <#{ch}> <@{a}>".format(
+        a=event['a'], r=recorder._id(3), ch=event['ch']
+    )
+
+
+def test_default_keys_differ(tmp_path):
+    first = TrafficRecorder(str(tmp_path / "first.jsonl"), anonymise=True)
+    second = TrafficRecorder(str(tmp_path / "second.jsonl"), anonymise=True)
+    asyncio.run(first.close())
+    asyncio.run(second.close())
+    assert first.salt != second.salt
+    assert first._id(1234) != second._id(1234)
+
+
+def test_appended_sessions_keep_times_ordered(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+    for session in range(2):
+        recorder = TrafficRecorder(path)
+        recorder.start -= 5
+        recorder.record("message", make_message(session * 2, "first"))
+        recorder.start -= 5
+        recorder.record("message", make_message(session * 2 + 1, "second"))
+        asyncio.run(recorder.close())
+        assert recorder.recorded == 2
+
+    events = list(load_events(path))
+    assert [event['id'] for event in events] == [0, 1, 2, 3]
+    # The second session continues from the last event of the first
+    assert [round(event['t']) for event in events] == [5, 10, 15, 20]
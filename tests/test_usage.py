@@ -0,0 +1,101 @@
+import time
+import asyncio
+
+from cmdClient.usage import UsageRecorder
+
+
+class MemorySink:
+    def __init__(self):
+        self.rows = []
+        self.closed = False
+
+    def open(self):
+        pass
+
+    def write(self, rows):
+        self.rows.extend(rows)
+
+    def close(self):
+        self.closed = True
+
+
+def test_open_buckets_are_not_flushed():
+    async def run():
+        sink = MemorySink()
+        recorder = UsageRecorder(sink, bucket_size=3600, flush_interval=3600)
+        recorder.record('ping', 1, 10, 0.1, 'success')
+        recorder.flush()
+        pending = len(recorder.buckets)
+        await recorder.close()
+        return sink, pending
+
+    sink, pending = asyncio.run(run())
+    assert pending == 1
+    assert sink.closed
+    assert len(sink.rows) == 1
+
+
+def test_distinct_users_are_counted_once_per_bucket():
+    async def run():
+        sink = MemorySink()
+        recorder = UsageRecorder(sink, bucket_size=3600, flush_interval=0.01)
+        for userid in (1, 2, 1):
+            recorder.record('ping', 1, userid, 0.1, 'success')
+            await asyncio.sleep(0.02)
+        await recorder.close()
+        return sink
+
+    sink = asyncio.run(run())
+    assert len(sink.rows) == 1
+    bucket, guildid, command, outcome, uses, users, total, longest = sink.rows[0]
+    assert (guildid, command, outcome, uses, users) == (1, 'ping', 'success', 3, 2)
+
+
+def test_closed_buckets_are_flushed():
+    async def run():
+        sink = MemorySink()
+        recorder = UsageRecorder(sink, bucket_size=3600, flush_interval=3600)
+        recorder.record('ping', 1, 10, 0.1, 'success')
+        # Move the recorded bucket into the past
+        (key, entry), = recorder.buckets.items()
+        recorder.buckets = {(key[0] - 3600,) + key[1:]: entry}
+        recorder.flush()
+        pending = len(recorder.buckets)
+        await recorder.close()
+        return sink, pending
+
+    sink, pending = asyncio.run(run())
+    assert pending == 0
+    assert sink.rows[0][0] < int(time.time()) // 3600 * 3600
+
+
+def test_close_does_not_block_the_loop_on_a_full_queue():
+    class SlowSink(MemorySink):
+        def write(self, rows):
+            time.sleep(0.3)
+            super().write(rows)
+
+    async def run():
+        recorder = UsageRecorder(SlowSink(), bucket_size=3600, flush_interval=3600, queue_size=1)
+        recorder.start()
+        for i in range(3):
+            recorder.record('ping', i, 1, 0.1, 'success')
+            recorder.flush(force=True)
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.ensure_future(ticker())
+        await recorder.close(timeout=2)
+        task.cancel()
+        return recorder, ticks
+
+    recorder, ticks = asyncio.run(run())
+    # The loop kept running while the writer drained the queue
+    assert ticks > 10
+    assert recorder.dropped_rows >= 1
@@ -0,0 +1,159 @@
+"""
+Lightweight per-invocation tracing of the command dispatch pipeline.
+
+A `Trace` is started for sampled command messages in `cmdClient.parse_message`,
+and carried on the `Context` as `ctx.trace`.
+Pipeline stages are timed with `span(trace, name)`, which is a no-op when the trace is `None`,
+so tracing costs a single function call per stage when disabled or unsampled.
+Finished traces are exported to a collector, such as a `MemoryCollector` or a `FileCollector`.
+"""
+import json
+import time
+import random
+from collections import deque
+
+
+class Span(object):
+    """
+    A timed stage of a trace. Used as a context manager.
+    """
+    __slots__ = ('trace', 'name', 'attrs', 'start', 'end')
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.spans.append(self)
+        return False
+
+    def as_list(self):
+        origin = self.trace.origin
+        return [
+            self.name,
+            round((self.start - origin) * 1000, 3),
+            round((self.end - self.start) * 1000, 3),
+            self.attrs
+        ]
+
+
+class _NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace(object):
+    """
+    The spans recorded while handling a single message.
+    """
+    __slots__ = ('trace_id', 'msgid', 'started_at', 'origin', 'spans')
+
+    def __init__(self, msgid=None):
+        self.trace_id = "{:016x}".format(random.getrandbits(64))
+        self.msgid = msgid
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def span(self, name, **attrs):
+        return Span(self, name, attrs)
+
+    def as_dict(self):
+        """
+        Returns the trace as a dictionary, with span offsets and durations in milliseconds.
+        """
+        return {
+            'trace': self.trace_id,
+            'mid': self.msgid,
+            'start': self.started_at,
+            'spans': [span.as_list() for span in self.spans]
+        }
+
+
+def span(trace, name, **attrs):
+    """
+    Returns a span context manager for the given trace, or a no-op if `trace` is `None`.
+    """
+    if trace is None:
+        return NULL_SPAN
+    return Span(trace, name, attrs)
+
+
+class MemoryCollector(object):
+    """
+    Keeps the most recent `maxlen` finished traces in memory.
+    """
+    def __init__(self, maxlen=1000):
+        self.traces = deque(maxlen=maxlen)
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+    def close(self):
+        pass
+
+
+class FileCollector(object):
+    """
+    Appends finished traces to a JSONL file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf8')
+
+    def export(self, trace):
+        self.file.write(json.dumps(trace.as_dict(), separators=(',', ':')))
+        self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Tracer(object):
+    """
+    Starts sampled traces and exports them once finished.
+    Attach to a client with `cmdClient(tracer=...)`.
+
+    Parameters
+    ----------
+    collector: MemoryCollector | FileCollector
+        Any object with `export(trace)` and `close()` methods.
+    sample_rate: float
+        Proportion of command messages to trace.
+    """
+    def __init__(self, collector, sample_rate=1.0):
+        self.collector = collector
+        self.sample_rate = sample_rate
+
+    def start(self, message):
+        """
+        Returns a new `Trace` for the given message if it is sampled, otherwise `None`.
+        """
+        if self.sample_rate >= 1 or random.random() < self.sample_rate:
+            return Trace(message.id)
+        return None
+
+    def finish(self, trace):
+        if trace is not None:
+            self.collector.export(trace)
+
+    def close(self):
+        self.collector.close()
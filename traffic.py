@@ -0,0 +1,424 @@
+"""
+Record and replay of inbound message traffic, for offline load and regression testing.
+
+A `TrafficRecorder` attached to a client streams inbound message and edit events to a compact JSONL log,
+serialising and writing them from a background thread so recording never blocks dispatch.
+Each recording session appended to a log starts with a header line, and event times are relative to the session start.
+A `TrafficReplayer` feeds such a log back into a client running against fake channels,
+and produces a `ReplayReport` of dispatch throughput, command latencies, and responses.
+"""
+import re
+import gzip
+import json
+import time
+import queue
+import asyncio
+import hashlib
+import logging
+import secrets
+import threading
+import traceback
+import contextvars
+from itertools import count
+
+from .logger import log
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf8')
+    return open(path, mode, encoding='utf8')
+
+
+_mention_pattern = re.compile(r"<(@!?|@&|#)(\d+)>")
+
+
+class TrafficRecorder(object):
+    """
+    Streams inbound `message` and `message_edit` events to a JSONL log.
+    Attach to a client with `cmdClient(recorder=...)`.
+    Logs ending in `.gz` are compressed.
+    Events are handed to a writer thread through a bounded queue, and dropped, and counted, when the queue is full.
+
+    Parameters
+    ----------
+    path: str
+        Path of the log to append to.
+    anonymise: bool
+        Whether to replace all ids, including the ids of mentions in the content, with stable keyed hashes.
+        Equal ids map to equal hashes, so the log remains consistent.
+    salt: Optional[bytes]
+        Key used for anonymisation. A random key is used if not given.
+    scrub: Optional[Function(str) -> str]
+        Optional function applied to the content of each recorded message.
+    queue_size: int
+        Maximum number of events waiting to be written.
+    """
+    def __init__(self, path, anonymise=False, salt=None, scrub=None, queue_size=10000):
+        self.path = path
+        self.anonymise = anonymise
+        self.salt = salt if salt is not None else secrets.token_bytes(16)
+        self.scrub = scrub
+
+        self.file = _open(path, 'a')
+        # Event times restart with each session, so replays use the header to keep them ordered
+        self.file.write(json.dumps({'session': time.time()}) + '\n')
+        self.start = time.monotonic()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._writer, name="traffic-writer", daemon=True)
+        self.thread.start()
+
+        # Metrics
+        self.recorded = 0
+        self.dropped = 0
+
+    def _id(self, snowflake):
+        if snowflake is None or not self.anonymise:
+            return snowflake
+        digest = hashlib.blake2b(str(snowflake).encode(), key=self.salt, digest_size=7).digest()
+        return int.from_bytes(digest, 'big')
+
+    def _content(self, content):
+        if self.anonymise:
+            # Hash mentioned ids consistently with the recorded ids
+            content = _mention_pattern.sub(
+                lambda match: "<{}{}>".format(match.group(1), self._id(int(match.group(2)))),
+                content
+            )
+        return self.scrub(content) if self.scrub is not None else content
+
+    def _write(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            if not self.dropped:
+                log("Traffic writer queue is full, dropping events.", context="TRAFFIC", level=logging.WARNING)
+            self.dropped += 1
+
+    def _writer(self):
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            try:
+                self.file.write(json.dumps(event, separators=(',', ':'), ensure_ascii=False))
+                self.file.write('\n')
+                self.recorded += 1
+            except Exception:
+                self.dropped += 1
+                log("Failed to write a traffic event.\n{}".format(traceback.format_exc()),
+                    context="TRAFFIC",
+                    level=logging.ERROR)
+        self.file.close()
+
+    def record(self, event, *args):
+        """
+        Record a dispatched event, ignoring events other than `message` and `message_edit`.
+        """
+        if event == "message":
+            message = args[0]
+            self._write(self._message_event('m', message))
+        elif event == "message_edit":
+            before, after = args
+            data = self._message_event('e', after)
+            data['b'] = self._content(before.content)
+            self._write(data)
+
+    def _message_event(self, kind, message):
+        return {
+            't': round(time.monotonic() - self.start, 4),
+            'e': kind,
+            'id': self._id(message.id),
+            'ch': self._id(message.channel.id),
+            'g': self._id(message.guild.id) if message.guild else None,
+            'a': self._id(message.author.id),
+            'bot': message.author.bot,
+            'c': self._content(message.content)
+        }
+
+    async def close(self, timeout=10):
+        """
+        Wait up to `timeout` seconds for the queued events to be written, and close the log.
+        """
+        if self.thread is not None:
+            # Waiting for queue space and for the writer may block, so do it off the event loop
+            await asyncio.get_event_loop().run_in_executor(None, self._stop_writer, self.thread, timeout)
+            self.thread = None
+
+    def _stop_writer(self, thread, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            log("Traffic writer queue is still full, abandoning the writer thread.",
+                context="TRAFFIC",
+                level=logging.WARNING)
+            return
+        thread.join(max(deadline - time.monotonic(), 0))
+
+
+def load_events(path):
+    """
+    Iterate over the events in a traffic log.
+    Sessions appended to the same log are replayed back to back,
+    with event times offset to continue from the last event of the previous session.
+    """
+    offset = 0
+    last = 0
+    with _open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                if 'session' in event:
+                    offset = last
+                    continue
+                event['t'] += offset
+                last = event['t']
+                yield event
+
+
+# Index of the replayed event currently being handled, inherited by tasks created while handling it
+_current_event = contextvars.ContextVar('current_event', default=None)
+
+
+class FakePermissions(object):
+    manage_messages = True
+
+
+class FakeUser(object):
+    def __init__(self, id, bot=False):
+        self.id = id
+        self.bot = bot
+        self.name = str(id)
+        self.display_name = self.name
+        self.mention = "<@{}>".format(id)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeGuild(object):
+    def __init__(self, id):
+        self.id = id
+        self.me = FakeUser(0, bot=True)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class FakeMessage(object):
+    def __init__(self, id, channel, author, content, embed=None):
+        self.id = id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embed = embed
+
+    async def delete(self):
+        self.channel.messages.pop(self.id, None)
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        self.channel.replayer.add_response(self.channel, content, embed, edit=True)
+        self.content = content
+        if embed is not None:
+            self.embed = embed
+
+
+class FakeChannel(object):
+    """
+    Fake text channel standing in for the discord HTTP layer.
+    Sent messages are recorded as responses to the event being handled.
+    """
+    def __init__(self, id, guild, replayer):
+        self.id = id
+        self.guild = guild
+        self.replayer = replayer
+        self.messages = {}
+
+    def __str__(self):
+        return str(self.id)
+
+    def permissions_for(self, member):
+        return FakePermissions()
+
+    async def send(self, content=None, embed=None, **kwargs):
+        await asyncio.sleep(self.replayer.send_latency)
+        message = FakeMessage(self.replayer.next_id(), self, self.guild.me if self.guild else FakeUser(0, True),
+                              content, embed)
+        self.messages[message.id] = message
+        self.replayer.add_response(self, content, embed)
+        return message
+
+    async def fetch_message(self, msgid):
+        return self.messages[msgid]
+
+    async def delete_messages(self, messages):
+        for message in messages:
+            self.messages.pop(message.id, None)
+
+
+class ReplayReport(object):
+    """
+    Results of a replay.
+    Reports may be saved with `dump` and compared across builds with `diff`.
+    """
+    def __init__(self, events=0, duration=0, latencies=None, responses=None):
+        self.events = events
+        self.duration = duration
+        self.latencies = latencies or {}  # Handler latency for each event, {index: seconds}
+        self.responses = responses or {}  # Responses to each event, {index: [str]}
+
+    @property
+    def throughput(self):
+        return self.events / self.duration if self.duration else 0
+
+    def percentiles(self, points=(50, 90, 99)):
+        """
+        Returns the given latency percentiles, along with the maximum.
+        """
+        values = sorted(self.latencies.values())
+        if not values:
+            return {}
+        result = {'p{}'.format(p): values[min(len(values) - 1, len(values) * p // 100)] for p in points}
+        result['max'] = values[-1]
+        return result
+
+    def summary(self):
+        lines = [
+            "Replayed {} events in {:.3f}s ({:.1f} events/s).".format(self.events, self.duration, self.throughput),
+            "Sent {} responses.".format(sum(len(resp) for resp in self.responses.values()))
+        ]
+        lines.extend("{}: {:.2f}ms".format(key, value * 1000) for key, value in self.percentiles().items())
+        return '\n'.join(lines)
+
+    def diff(self, other):
+        """
+        Returns a list of `(index, responses, other_responses)` for the events with differing responses.
+        """
+        indices = sorted(set(self.responses) | set(other.responses))
+        return [
+            (i, self.responses.get(i, []), other.responses.get(i, []))
+            for i in indices
+            if self.responses.get(i, []) != other.responses.get(i, [])
+        ]
+
+    def dump(self, path):
+        with _open(path, 'w') as f:
+            f.write(json.dumps({'events': self.events, 'duration': self.duration}) + '\n')
+            for i in range(self.events):
+                f.write(json.dumps({
+                    'i': i,
+                    'latency': self.latencies.get(i),
+                    'responses': self.responses.get(i, [])
+                }, ensure_ascii=False) + '\n')
+
+    @classmethod
+    def load(cls, path):
+        with _open(path, 'r') as f:
+            header = json.loads(f.readline())
+            report = cls(header['events'], header['duration'])
+            for line in f:
+                data = json.loads(line)
+                if data['latency'] is not None:
+                    report.latencies[data['i']] = data['latency']
+                if data['responses']:
+                    report.responses[data['i']] = data['responses']
+        return report
+
+
+class TrafficReplayer(object):
+    """
+    Feeds a recorded traffic log into a client, using fake channels in place of discord.
+
+    Parameters
+    ----------
+    client: cmdClient
+        The client to replay into. It does not need to be logged in.
+    speed: Optional[float]
+        Replay speed relative to the recording, or `None` to replay as fast as possible.
+    send_latency: float
+        Simulated latency of each fake send, in seconds.
+    """
+    def __init__(self, client, speed=1.0, send_latency=0):
+        self.client = client
+        self.speed = speed
+        self.send_latency = send_latency
+
+        self.channels = {}
+        self.guilds = {}
+        self.users = {}
+        self.messages = {}
+        self._ids = count(1 << 60)
+        self.report = None
+
+    def next_id(self):
+        return next(self._ids)
+
+    def add_response(self, channel, content, embed, edit=False):
+        index = _current_event.get()
+        if index is None or self.report is None:
+            return
+        if embed is not None:
+            embed = embed.to_dict() if hasattr(embed, 'to_dict') else embed
+            embed.pop('timestamp', None)
+        rendered = json.dumps({'edit': edit, 'content': content, 'embed': embed}, sort_keys=True, ensure_ascii=False)
+        self.report.responses.setdefault(index, []).append(rendered)
+
+    def _channel(self, event):
+        guild = None
+        if event['g'] is not None:
+            guild = self.guilds.get(event['g'], None)
+            if guild is None:
+                guild = self.guilds[event['g']] = FakeGuild(event['g'])
+        channel = self.channels.get(event['ch'], None)
+        if channel is None:
+            channel = self.channels[event['ch']] = FakeChannel(event['ch'], guild, self)
+        return channel
+
+    def _user(self, event):
+        user = self.users.get(event['a'], None)
+        if user is None:
+            user = self.users[event['a']] = FakeUser(event['a'], event.get('bot', False))
+        return user
+
+    async def _handle(self, index, event):
+        _current_event.set(index)
+        channel = self._channel(event)
+        author = self._user(event)
+        message = FakeMessage(event['id'], channel, author, event['c'])
+
+        start = time.perf_counter()
+        if event['e'] == 'm':
+            self.messages[message.id] = message
+            if self.client.input_waiters:
+                self.client.route_input(message)
+            await self.client.on_message(message)
+        else:
+            before = self.messages.get(message.id, None) or FakeMessage(message.id, channel, author, event['b'])
+            self.messages[message.id] = message
+            await self.client.on_message_edit(before, message)
+        self.report.latencies[index] = time.perf_counter() - start
+
+    async def replay(self, events):
+        """
+        Replay the given events, or the events in the log at the given path.
+        Returns a `ReplayReport`.
+        """
+        if isinstance(events, str):
+            events = load_events(events)
+
+        self.report = ReplayReport()
+        tasks = []
+        loop_start = time.perf_counter()
+        for index, event in enumerate(events):
+            if self.speed is not None:
+                delay = event['t'] / self.speed - (time.perf_counter() - loop_start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(self._handle(index, event)))
+            self.report.events += 1
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.report.duration = time.perf_counter() - loop_start
+        return self.report
@@ -0,0 +1,217 @@
+"""
+Batched command usage analytics.
+
+A `UsageRecorder` attached with `cmdClient(usage=...)` receives the outcome of every `run_cmd`,
+aggregates it in memory into time buckets, and periodically hands the aggregated rows
+to a background thread which writes them in bulk to a sink.
+Recording never blocks dispatch: data is dropped, and counted, when the buffers are full.
+"""
+import time
+import queue
+import asyncio
+import logging
+import sqlite3
+import threading
+import traceback
+
+from .logger import log
+
+
+class SQLiteUsageSink(object):
+    """
+    Default usage sink, writing aggregated rows to a SQLite table.
+    All methods are called from the recorder writer thread.
+    """
+    def __init__(self, path="usage.db", table="command_usage"):
+        self.path = path
+        self.table = table
+        self.conn = None
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS {} ("
+            "bucket INTEGER, guildid INTEGER, command TEXT, outcome TEXT, "
+            "uses INTEGER, users INTEGER, total_duration REAL, max_duration REAL)".format(self.table)
+        )
+        self.conn.commit()
+
+    def write(self, rows):
+        self.conn.executemany("INSERT INTO {} VALUES (?, ?, ?, ?, ?, ?, ?, ?)".format(self.table), rows)
+        self.conn.commit()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class UsageRecorder(object):
+    """
+    Aggregates command usage into time buckets and flushes it in bulk to a sink.
+
+    Each aggregated row is `(bucket, guildid, command, outcome, uses, users, total_duration, max_duration)`,
+    where `bucket` is the unix time at the start of the bucket and `users` is the number of distinct users.
+
+    Parameters
+    ----------
+    sink: Optional[SQLiteUsageSink]
+        Any object with `open()`, `write(rows)` and `close()` methods, defaulting to a `SQLiteUsageSink`.
+    bucket_size: int
+        Length of each time bucket in seconds.
+    flush_interval: float
+        Number of seconds between flushes of the closed buckets.
+    queue_size: int
+        Maximum number of flushed batches waiting to be written.
+    max_keys: int
+        Maximum number of aggregated rows held in memory between flushes.
+    """
+    def __init__(self, sink=None, bucket_size=60, flush_interval=30, queue_size=100, max_keys=100000):
+        self.sink = sink or SQLiteUsageSink()
+        self.bucket_size = bucket_size
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+
+        self.buckets = {}  # {(bucket, guildid, command, outcome): [uses, {userid}, total_duration, max_duration]}
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.thread = None
+        self.flush_task = None
+
+        # Metrics
+        self.recorded = 0
+        self.dropped_events = 0
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self.write_errors = 0
+
+    def stats(self):
+        return {
+            'recorded': self.recorded,
+            'pending_rows': len(self.buckets),
+            'queued_batches': self.queue.qsize(),
+            'written_rows': self.written_rows,
+            'dropped_events': self.dropped_events,
+            'dropped_rows': self.dropped_rows,
+            'write_errors': self.write_errors
+        }
+
+    def start(self):
+        """
+        Start the writer thread and the periodic flush task.
+        Called automatically on the first record.
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._writer, name="usage-writer", daemon=True)
+            self.thread.start()
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self._flush_loop())
+
+    def record(self, cmdname, guildid, userid, duration, outcome):
+        """
+        Record a single command invocation. Never blocks.
+        """
+        if self.flush_task is None:
+            self.start()
+
+        bucket = int(time.time()) // self.bucket_size * self.bucket_size
+        key = (bucket, guildid, cmdname, outcome)
+        entry = self.buckets.get(key, None)
+        if entry is None:
+            if len(self.buckets) >= self.max_keys:
+                self.dropped_events += 1
+                return
+            entry = self.buckets[key] = [0, set(), 0.0, 0.0]
+        entry[0] += 1
+        entry[1].add(userid)
+        entry[2] += duration
+        entry[3] = max(entry[3], duration)
+        self.recorded += 1
+
+    def flush(self, force=False):
+        """
+        Hand the aggregated rows of the closed buckets to the writer thread, dropping them if its queue is full.
+        Open buckets are kept, so each bucket is written as a single row and the distinct user counts are exact.
+        If `force` is set, the open buckets are also flushed, e.g. on shutdown.
+        """
+        if not self.buckets:
+            return
+        if force:
+            buckets, self.buckets = self.buckets, {}
+        else:
+            current = int(time.time()) // self.bucket_size * self.bucket_size
+            buckets = {key: entry for key, entry in self.buckets.items() if key[0] < current}
+            if not buckets:
+                return
+            for key in buckets:
+                del self.buckets[key]
+        rows = [
+            (bucket, guildid, cmdname, outcome, uses, len(users), total, longest)
+            for (bucket, guildid, cmdname, outcome), (uses, users, total, longest) in buckets.items()
+        ]
+        try:
+            self.queue.put_nowait(rows)
+        except queue.Full:
+            self.dropped_rows += len(rows)
+            log("Usage writer queue is full, dropped {} usage rows.".format(len(rows)),
+                context="USAGE",
+                level=logging.WARNING)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    def _writer(self):
+        try:
+            self.sink.open()
+        except Exception:
+            log("Failed to open usage sink.\n{}".format(traceback.format_exc()),
+                context="USAGE",
+                level=logging.ERROR)
+            return
+
+        while True:
+            rows = self.queue.get()
+            if rows is None:
+                break
+            try:
+                self.sink.write(rows)
+                self.written_rows += len(rows)
+            except Exception:
+                self.write_errors += 1
+                self.dropped_rows += len(rows)
+                log("Failed to write {} usage rows.\n{}".format(len(rows), traceback.format_exc()),
+                    context="USAGE",
+                    level=logging.ERROR)
+        self.sink.close()
+
+    async def close(self, timeout=10):
+        """
+        Flush the remaining rows and wait up to `timeout` seconds for the writer thread to finish.
+        """
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.flush(force=True)
+        if self.thread is not None:
+            # Waiting for queue space and for the writer may block, so do it off the event loop
+            await asyncio.get_event_loop().run_in_executor(None, self._stop_writer, self.thread, timeout)
+            self.thread = None
+
+    def _stop_writer(self, thread, timeout):
+        deadline = time.monotonic() + timeout
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            log("Usage writer queue is still full, abandoning the writer thread.",
+                context="USAGE",
+                level=logging.WARNING)
+            return
+        thread.join(max(deadline - time.monotonic(), 0))
+
+    async def on_drain(self, client):
+        """
+        Drain hook closing the recorder.
+        """
+        await self.close()